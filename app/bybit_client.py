@@ -3,14 +3,10 @@ import logging
 from pybit.unified_trading import WebSocket, HTTP
 from dotenv import load_dotenv
 import asyncio
+import threading
+from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime, timezone
 
-# Configuración de logging para este cliente
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - BYBIT_CLIENT - %(message)s'
-)
-
 class BybitClient:
     """
     Cliente unificado de Bybit para trading.
@@ -31,9 +27,22 @@ class BybitClient:
             api_key=self.api_key,
             api_secret=self.api_secret
         )
+        self._init_state()
+
+    def _init_state(self):
+        """
+        Estado de conexiones, colas y cachés. Separado de __init__ para que los
+        clientes sin credenciales (p. ej. el exchange simulado de soak_harness.py)
+        lo compartan.
+        """
         self.ws_private = None
+        self.ws_public = None
+        self._ws_public_lock = threading.Lock()
+        self.loop = None
         self.event_queue = None
+        self.event_queues = []
         self.last_closed_pnl_time_ms = None
+        self.tick_sizes = {}
 
     def connect_and_listen_websocket(self, event_queue):
         """
@@ -43,6 +52,7 @@ class BybitClient:
         
         async def _websocket_listener():
             logging.info("WebSocket Unified V5 (Private) intentando conexión...")
+            self.loop = asyncio.get_running_loop()
             
             # Crear WebSocket privado con autenticación
             self.ws_private = WebSocket(
@@ -52,34 +62,14 @@ class BybitClient:
                 api_secret=self.api_secret
             )
             
-            # Callback para manejar mensajes de posiciones
-            def handle_position(message):
-                try:
-                    logging.debug(f"Mensaje de posición recibido: {message}")
-                    asyncio.create_task(self.event_queue.put({
-                        'topic': 'position',
-                        'data': message
-                    }))
-                except Exception as e:
-                    logging.error(f"Error procesando mensaje de posición: {e}")
-            
-            # Callback para manejar mensajes de wallet
-            def handle_wallet(message):
-                try:
-                    logging.debug(f"Mensaje de wallet recibido: {message}")
-                    asyncio.create_task(self.event_queue.put({
-                        'topic': 'wallet',
-                        'data': message
-                    }))
-                except Exception as e:
-                    logging.error(f"Error procesando mensaje de wallet: {e}")
-            
             # Suscribirse a los canales
-            self.ws_private.position_stream(callback=handle_position)
-            self.ws_private.wallet_stream(callback=handle_wallet)
+            self.ws_private.position_stream(callback=self._make_stream_handler('position'))
+            self.ws_private.wallet_stream(callback=self._make_stream_handler('wallet'))
+            self.ws_private.execution_stream(callback=self._make_stream_handler('execution'))
+            self.ws_private.order_stream(callback=self._make_stream_handler('order'))
             
             logging.info("WebSocket Unified V5 (Private) conectado exitosamente")
-            logging.info("Suscrito a canales: position, wallet")
+            logging.info("Suscrito a canales: position, wallet, execution, order")
             
             # Mantener la conexión activa
             while True:
@@ -87,6 +77,84 @@ class BybitClient:
         
         return _websocket_listener()
 
+    def add_event_queue(self, queue, topics):
+        """
+        Registra una cola adicional que recibe los eventos de los topics indicados.
+        La cola principal (event_queue) sigue recibiendo todos los eventos.
+        """
+        self.event_queues.append((queue, frozenset(topics)))
+
+    def _make_stream_handler(self, topic):
+        """
+        Crea el callback de un canal privado. pybit lo invoca desde su propio hilo,
+        por lo que el evento se entrega a las colas desde el hilo del event loop.
+        """
+        def handle_message(message):
+            try:
+                logging.debug("Mensaje de %s recibido: %s", topic, message)
+                self.loop.call_soon_threadsafe(self._dispatch_event, {
+                    'topic': topic,
+                    'data': message
+                })
+            except Exception as e:
+                logging.error("Error procesando mensaje de %s: %s", topic, e)
+        
+        return handle_message
+
+    def _dispatch_event(self, event):
+        """
+        Entrega un evento a la cola principal y a las colas registradas para su topic.
+        """
+        self.event_queue.put_nowait(event)
+        for queue, topics in self.event_queues:
+            if event['topic'] in topics:
+                queue.put_nowait(event)
+
+    def subscribe_kline(self, symbol, interval, callback):
+        """
+        Suscribe un símbolo al stream público de klines (linear).
+
+        pybit invoca los callbacks desde su propio hilo; si el event loop ya está
+        disponible el callback se reenvía al hilo del loop con call_soon_threadsafe.
+        Es bloqueante (abre la conexión en la primera llamada) y se puede llamar
+        desde cualquier hilo.
+        """
+        with self._ws_public_lock:
+            if self.ws_public is None:
+                logging.info("WebSocket Unified V5 (Public linear) intentando conexión...")
+                self.ws_public = WebSocket(
+                    testnet=self.testnet,
+                    channel_type="linear"
+                )
+
+        def handle_kline(message):
+            try:
+                if self.loop is not None:
+                    self.loop.call_soon_threadsafe(callback, message)
+                else:
+                    callback(message)
+            except Exception as e:
+                logging.error("Error procesando mensaje de kline: %s", e)
+
+        self.ws_public.kline_stream(interval=interval, symbol=symbol, callback=handle_kline)
+        logging.info("Suscrito a klines de %s (%s min)", symbol, interval)
+
+    def get_kline(self, symbol, interval, limit=200):
+        """
+        Obtiene velas históricas (de la más reciente a la más antigua).
+        """
+        try:
+            response = self.session.get_kline(
+                category="linear",
+                symbol=symbol,
+                interval=interval,
+                limit=limit
+            )
+            return response
+        except Exception as e:
+            logging.error("Error al obtener velas de %s: %s", symbol, e)
+            return None
+
     def get_wallet_balance(self):
         """
         Obtiene el balance de la cartera para la cuenta unificada.
@@ -118,36 +186,83 @@ class BybitClient:
         # ... (lógica de place_order)
         pass
 
-    def set_trading_stop(self, symbol, stop_loss, side=None):
+    def set_trading_stop(self, symbol, stop_loss, side=None, trailing_stop=None, active_price=None):
         """
         Modifica el Stop Loss de una posición existente.
         
         Args:
             symbol: Símbolo de la posición (ej: 'BTCUSDT')
-            stop_loss: Nuevo precio de Stop Loss
+            stop_loss: Nuevo precio de Stop Loss (None para no modificarlo)
             side: 'Buy' o 'Sell' (opcional, pybit lo detecta automáticamente)
+            trailing_stop: Distancia (en precio) del trailing stop nativo de Bybit (opcional)
+            active_price: Precio de activación del trailing stop nativo (opcional)
         """
         try:
             params = {
                 "category": "linear",
                 "symbol": symbol,
-                "stopLoss": str(stop_loss),
                 "positionIdx": 0  # 0 para modo one-way
             }
             
-            logging.info(f"Modificando Stop Loss para {symbol} a {stop_loss}")
+            if stop_loss is not None:
+                params["stopLoss"] = str(stop_loss)
+            
+            if trailing_stop is not None:
+                params["trailingStop"] = str(trailing_stop)
+            
+            if active_price is not None:
+                params["activePrice"] = str(active_price)
+            
+            if trailing_stop is not None:
+                logging.info("Configurando trailing stop nativo para %s - Distancia: %s, Activación: %s, SL: %s",
+                             symbol, trailing_stop, active_price, stop_loss)
+            else:
+                logging.info("Modificando Stop Loss para %s a %s", symbol, stop_loss)
             response = self.session.set_trading_stop(**params)
             
             if response.get('retCode') == 0:
-                logging.info(f"Stop Loss actualizado exitosamente para {symbol}")
+                logging.info("Stop Loss actualizado exitosamente para %s", symbol)
             else:
-                logging.error(f"Error al actualizar Stop Loss: {response}")
+                logging.error("Error al actualizar Stop Loss: %s", response)
             
             return response
         except Exception as e:
-            logging.error(f"Error al modificar Stop Loss para {symbol}: {e}")
+            logging.error("Error al modificar Stop Loss para %s: %s", symbol, e)
             return None
 
+    def get_tick_size(self, symbol):
+        """
+        Obtiene el tick size del símbolo (cacheado tras la primera consulta).
+        """
+        if symbol in self.tick_sizes:
+            return self.tick_sizes[symbol]
+        
+        try:
+            response = self.session.get_instruments_info(category="linear", symbol=symbol)
+            instruments = response.get('result', {}).get('list', [])
+            if not instruments:
+                logging.warning("No se encontró información del instrumento %s", symbol)
+                return None
+            
+            tick_size = Decimal(instruments[0]['priceFilter']['tickSize'])
+            self.tick_sizes[symbol] = tick_size
+            return tick_size
+        except Exception as e:
+            logging.error("Error al obtener el tick size de %s: %s", symbol, e)
+            return None
+
+    def round_to_tick(self, symbol, price, rounding=ROUND_HALF_UP):
+        """
+        Redondea un precio (o distancia de precio) al tick size del símbolo.
+        Devuelve un Decimal, o None si no se conoce el tick size.
+        """
+        tick_size = self.get_tick_size(symbol)
+        if not tick_size:
+            return None
+        
+        ticks = (Decimal(str(price)) / tick_size).quantize(Decimal(1), rounding=rounding)
+        return ticks * tick_size
+
     def get_closed_pnl(self, symbol=None, start_time=None, limit=50):
         """
         Obtiene el historial de PnL cerrado (operaciones cerradas).
@@ -171,7 +286,7 @@ class BybitClient:
             elif self.last_closed_pnl_time_ms:
                 params["startTime"] = self.last_closed_pnl_time_ms
             
-            logging.info(f"Obteniendo historial de PnL cerrado...")
+            logging.info("Obteniendo historial de PnL cerrado...")
             response = self.session.get_closed_pnl(**params)
             return response
         except Exception as e:
@@ -3,94 +3,331 @@ import logging
 import csv
 import os
 import json
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 
+from trade_analytics import format_report
+
+TRADE_HEADERS = ['Contracts', 'Closing Direction', 'Qty', 'Entry Value', 'Exit Value', 'Entry Price', 'Take Profit Price', 'Stop Loss Price', 'Exit Price', 'Closed PnL', 'Filled Type', 'Open Time / UTC Time', 'Close Time / UTC Time']
+
+# Máximo de orderIds recordados para no duplicar operaciones en la conciliación
+MAX_JOURNALED_ORDERS = 10000
+
+
 class DataLogger:
     """Gestiona el registro de operaciones cerradas en un archivo CSV."""
     # El constructor solo espera 2 argumentos para que coincida con main.py
-    def __init__(self, bybit_client, event_queue: asyncio.Queue):
+    def __init__(self, bybit_client, event_queue: asyncio.Queue, analytics=None):
         self.bybit_client = bybit_client
         self.event_queue = event_queue
-    
+
+        # Analítica incremental de operaciones cerradas (opcional, ver trade_analytics.py)
+        self.analytics = analytics
+
+        # Conciliación periódica con get_closed_pnl (REST)
+        self.reconcile_interval = float(os.getenv('CLOSED_PNL_RECONCILE_SECONDS', '300'))
+
+        # Precio de entrada por símbolo (del stream de posiciones) para operaciones sin execPnl
+        self.entry_prices = {}
+
+        # Mejor mark price visto por símbolo mientras la posición está abierta (give-back),
+        # con el lado de la posición a la que corresponde
+        self.peak_prices = {}
+        self.peak_sides = {}
+
+        # Pico de la última posición cerrada de cada símbolo, hasta que su ejecución
+        # de cierre (que puede llegar después del push con size = 0) se registra
+        self.closed_peaks = {}
+
+        # Ejecuciones de cierre acumuladas por orderId hasta que la orden se completa
+        # o se cancela. Las que superan la antigüedad máxima se descartan y quedan
+        # para la conciliación REST.
+        self.pending_fills = {}
+        self.pending_fill_max_age = float(os.getenv('PENDING_FILL_MAX_AGE_SECONDS', '3600'))
+
+        # orderIds ya registrados desde el stream de ejecuciones
+        self.journaled_orders = OrderedDict()
+
     async def run(self):
         """Bucle principal para procesar eventos de la cola."""
+        # Conciliación inicial: recupera las operaciones cerradas con el bot detenido
+        self._export_closed_positions_to_csv()
+        last_reconcile = time.monotonic()
+
         while True:
             try:
-                event = await self.event_queue.get()
+                timeout = max(0.0, self.reconcile_interval - (time.monotonic() - last_reconcile))
+
+                try:
+                    event = await asyncio.wait_for(self.event_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    event = None
+
+                if event is not None:
+                    if event['topic'] == 'execution':
+                        self._process_execution_event(event['data'])
+                    elif event['topic'] == 'order':
+                        self._process_order_event(event['data'])
+                    elif event['topic'] == 'position':
+                        self._process_position_event(event['data'])
+
+                    self.event_queue.task_done()
 
-                if event['topic'] in ['wallet', 'position']:
-                    logging.info("Evento recibido en el logger. Exportando operaciones cerradas...")
+                if time.monotonic() - last_reconcile >= self.reconcile_interval:
+                    last_reconcile = time.monotonic()
+                    self._expire_pending_fills()
                     self._export_closed_positions_to_csv()
-                
-                self.event_queue.task_done()
             except Exception as e:
-                logging.error(f"Error en el registrador de datos: {e}")
+                logging.error("Error en el registrador de datos: %s", e)
                 logging.exception(e)
-            
-            await asyncio.sleep(1)
+
+    def _process_position_event(self, event_data):
+        """
+        Guarda el precio de entrada de las posiciones abiertas (el stream de
+        ejecuciones no lo incluye) y el mejor mark price alcanzado. El pico se
+        reinicia cuando la posición se cierra o cambia de lado.
+        """
+        positions = event_data['data'] if 'data' in event_data else [event_data]
+        for pos_data in positions:
+            symbol = pos_data.get('symbol')
+            if not symbol:
+                continue
+
+            if float(pos_data.get('size', 0) or 0) <= 0:
+                peak_price = self.peak_prices.pop(symbol, None)
+                self.peak_sides.pop(symbol, None)
+                if peak_price is not None:
+                    self.closed_peaks[symbol] = peak_price
+                continue
+
+            self.entry_prices[symbol] = float(pos_data.get('avgPrice', 0) or 0)
+
+            side = pos_data.get('side')
+            if self.peak_sides.get(symbol) != side:
+                # Posición nueva (o invertida): el pico anterior ya no aplica
+                self.peak_prices.pop(symbol, None)
+                self.closed_peaks.pop(symbol, None)
+                self.peak_sides[symbol] = side
+
+            mark_price = float(pos_data.get('markPrice', 0) or 0)
+            if mark_price <= 0:
+                continue
+            peak_price = self.peak_prices.get(symbol)
+            if peak_price is None or \
+               (side == 'Buy' and mark_price > peak_price) or \
+               (side == 'Sell' and mark_price < peak_price):
+                self.peak_prices[symbol] = mark_price
+
+    def _process_execution_event(self, event_data):
+        """
+        Construye el registro de la operación cerrada directamente desde el stream
+        de ejecuciones: acumula los fills de cierre de cada orden y registra la
+        operación cuando la orden queda completa (leavesQty = 0).
+        """
+        executions = event_data['data'] if 'data' in event_data else [event_data]
+        for execution in executions:
+            if execution.get('execType') != 'Trade':
+                continue
+
+            closed_size = float(execution.get('closedSize') or 0)
+            if closed_size <= 0:
+                continue
+
+            order_id = execution.get('orderId')
+            exec_price = float(execution.get('execPrice') or 0)
+
+            fill = self.pending_fills.get(order_id)
+            if fill is None:
+                fill = {
+                    'symbol': execution.get('symbol'),
+                    'side': execution.get('side'),
+                    'filled_type': execution.get('stopOrderType') or execution.get('orderType') or '',
+                    'qty': 0.0,
+                    'exit_value': 0.0,
+                    'fee': 0.0,
+                    'pnl': 0.0,
+                    'has_pnl': False,
+                    'first_seen': time.monotonic()
+                }
+                self.pending_fills[order_id] = fill
+
+            fill['qty'] += closed_size
+            fill['exit_value'] += exec_price * closed_size
+            fill['fee'] += float(execution.get('execFee') or 0)
+            if execution.get('execPnl') not in (None, ''):
+                fill['pnl'] += float(execution['execPnl'])
+                fill['has_pnl'] = True
+            fill['close_time_ms'] = int(execution.get('execTime') or 0)
+
+            if float(execution.get('leavesQty') or 0) == 0:
+                del self.pending_fills[order_id]
+                self._journal_execution_trade(order_id, fill)
+
+    def _process_order_event(self, event_data):
+        """
+        Cierra el seguimiento de las órdenes de cierre canceladas tras un fill
+        parcial (p. ej. el resto de una IOC o de una orden a mercado): la parte
+        ejecutada se registra como operación y el orderId deja de acumularse.
+        """
+        orders = event_data['data'] if 'data' in event_data else [event_data]
+        for order in orders:
+            if order.get('orderStatus') not in ('Cancelled', 'PartiallyFilledCanceled', 'Rejected', 'Deactivated'):
+                continue
+            order_id = order.get('orderId')
+            fill = self.pending_fills.pop(order_id, None)
+            if fill is not None:
+                self._journal_execution_trade(order_id, fill)
+
+    def _expire_pending_fills(self):
+        """
+        Descarta las órdenes de cierre sin completar más antiguas que
+        PENDING_FILL_MAX_AGE_SECONDS (p. ej. si se perdió su mensaje de
+        cancelación); la conciliación REST registra esas operaciones.
+        """
+        cutoff = time.monotonic() - self.pending_fill_max_age
+        expired = [order_id for order_id, fill in self.pending_fills.items() if fill['first_seen'] < cutoff]
+        for order_id in expired:
+            del self.pending_fills[order_id]
+        if expired:
+            logging.warning("Descartadas %d órdenes de cierre incompletas; se concilian por REST", len(expired))
+
+    def _journal_execution_trade(self, order_id, fill):
+        symbol = fill['symbol']
+        qty = fill['qty']
+        avg_exit_price = fill['exit_value'] / qty
+        avg_entry_price = self.entry_prices.get(symbol, 0.0)
+
+        if fill['has_pnl']:
+            closed_pnl = fill['pnl']
+        elif avg_entry_price > 0:
+            # Estimación: una orden 'Sell' cierra un LONG y una 'Buy' cierra un SHORT
+            direction = 1 if fill['side'] == 'Sell' else -1
+            closed_pnl = (avg_exit_price - avg_entry_price) * qty * direction - fill['fee']
+        else:
+            closed_pnl = 0.0
+
+        # Give-back: distancia (en %) entre el mejor precio alcanzado y el precio de salida
+        giveback_percent = None
+        peak_price = self.closed_peaks.pop(symbol, None)
+        if peak_price is None:
+            peak_price = self.peak_prices.pop(symbol, None)
+            self.peak_sides.pop(symbol, None)
+        if peak_price:
+            giveback_percent = abs(peak_price - avg_exit_price) / peak_price * 100
+
+        row = self._format_trade_row(
+            symbol, fill['side'], qty, avg_entry_price, avg_exit_price,
+            0, 0, closed_pnl, fill['filled_type'], fill['close_time_ms']
+        )
+        logging.info("💰 Operación cerrada (execution): %s", ",".join(row))
+        self._record_analytics(order_id, symbol, closed_pnl, fill['close_time_ms'], giveback_percent)
+
+        self.journaled_orders[order_id] = True
+        if len(self.journaled_orders) > MAX_JOURNALED_ORDERS:
+            self.journaled_orders.popitem(last=False)
+
+    def _record_analytics(self, trade_id, symbol, closed_pnl, close_time_ms, giveback_percent=None):
+        if self.analytics is None:
+            return
+        try:
+            if not self.analytics.add_trade(symbol, closed_pnl, close_time_ms, giveback_percent, trade_id=trade_id):
+                return
+            logging.info("📈 %s", format_report("Rendimiento histórico", self.analytics.report()))
+        except Exception as e:
+            logging.error("Error actualizando la analítica de operaciones: %s", e)
+
+    def _format_trade_row(self, symbol, closing_side, closed_size, avg_entry_price, avg_exit_price,
+                          take_profit, stop_loss, closed_pnl, filled_type, close_time_ms):
+        """
+        Formatea una operación cerrada con las columnas de TRADE_HEADERS.
+        """
+        close_time_utc = datetime.fromtimestamp(close_time_ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+
+        entry_value = avg_entry_price * closed_size
+        exit_value = avg_exit_price * closed_size
+
+        if closing_side == 'Sell':
+            closing_direction = 'Close Long'
+        elif closing_side == 'Buy':
+            closing_direction = 'Close Short'
+        else:
+            closing_direction = 'Unknown'
+
+        take_profit_str = str(take_profit) if float(take_profit) > 0 else 'N/A'
+        stop_loss_str = str(stop_loss) if float(stop_loss) > 0 else 'N/A'
+
+        return [
+            symbol,
+            closing_direction,
+            str(closed_size),
+            f'{entry_value:.2f}',
+            f'{exit_value:.2f}',
+            str(avg_entry_price),
+            take_profit_str,
+            stop_loss_str,
+            str(avg_exit_price),
+            str(closed_pnl),
+            filled_type,
+            'Unknown',
+            close_time_utc
+        ]
 
     def _export_closed_positions_to_csv(self):
         """
-        Consulta las operaciones cerradas y las imprime en la consola.
+        Conciliación periódica: consulta las operaciones cerradas por REST e imprime
+        en la consola las que no llegaron por el stream de ejecuciones.
         """
         try:
             response = self.bybit_client.get_closed_pnl()
 
             if not response or 'result' not in response or 'list' not in response['result']:
-                logging.info("No hay nuevas operaciones cerradas para registrar.")
+                logging.info("No hay nuevas operaciones cerradas para registrar.", extra={'rate_key': 'no_closed_pnl'})
                 return
-            
+
             closed_positions = sorted(response['result']['list'], key=lambda x: int(x['createdTime']))
             if not closed_positions:
-                logging.info("No hay nuevas operaciones cerradas para registrar.")
+                logging.info("No hay nuevas operaciones cerradas para registrar.", extra={'rate_key': 'no_closed_pnl'})
                 return
-            
+
+            self.bybit_client.last_closed_pnl_time_ms = int(closed_positions[-1]['createdTime']) + 1
+
+            missing = [r for r in closed_positions if r.get('orderId') not in self.journaled_orders]
+            if not missing:
+                logging.info("Conciliación de PnL cerrado: %d operaciones ya registradas por el stream de ejecuciones",
+                             len(closed_positions))
+                return
+
             logging.info("-" * 80)
-            logging.info("Operaciones Cerradas (Salida Temporal a Consola)")
+            logging.info("Operaciones Cerradas (conciliación REST, %d no recibidas por el stream)", len(missing))
             logging.info("-" * 80)
-            
-            headers = ['Contracts', 'Closing Direction', 'Qty', 'Entry Value', 'Exit Value', 'Entry Price', 'Take Profit Price', 'Stop Loss Price', 'Exit Price', 'Closed PnL', 'Filled Type', 'Open Time / UTC Time', 'Close Time / UTC Time']
-            logging.info(",".join(headers))
-            
-            for pnl_record in closed_positions:
-                symbol = pnl_record['symbol']
-                closed_size = float(pnl_record.get('closedSize', 0) or 0)
-                avg_entry_price = float(pnl_record.get('avgEntryPrice', 0) or 0)
-                avg_exit_price = float(pnl_record.get('avgExitPrice', 0) or 0)
-                closed_pnl = float(pnl_record.get('closedPnl', 0) or 0)
-                exec_type = pnl_record.get('execType', '')
-                created_time_ms = int(pnl_record.get('createdTime', 0))
-                
-                close_time_utc = datetime.fromtimestamp(created_time_ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
-                
-                entry_value = avg_entry_price * closed_size
-                exit_value = avg_exit_price * closed_size
-                
-                take_profit_value = str(pnl_record.get('takeProfit', 0))
-                stop_loss_value = str(pnl_record.get('stopLoss', 0))
-
-                take_profit_str = take_profit_value if float(take_profit_value) > 0 else 'N/A'
-                stop_loss_str = stop_loss_value if float(stop_loss_value) > 0 else 'N/A'
-
-                row = [
-                    symbol,
-                    'Unknown', 
-                    str(closed_size),
-                    f'{entry_value:.2f}',
-                    f'{exit_value:.2f}',
-                    str(avg_entry_price),
-                    take_profit_str,
-                    stop_loss_str,
-                    str(avg_exit_price),
-                    str(closed_pnl),
-                    exec_type,
-                    'Unknown', 
-                    close_time_utc
-                ]
+
+            logging.info(",".join(TRADE_HEADERS))
+
+            for pnl_record in missing:
+                # El pico pertenece a esta posición ya cerrada; no debe heredarlo la siguiente
+                self.closed_peaks.pop(pnl_record['symbol'], None)
+                self._record_analytics(
+                    pnl_record.get('orderId'),
+                    pnl_record['symbol'],
+                    float(pnl_record.get('closedPnl', 0) or 0),
+                    int(pnl_record.get('createdTime', 0))
+                )
+                row = self._format_trade_row(
+                    pnl_record['symbol'],
+                    pnl_record.get('side'),
+                    float(pnl_record.get('closedSize', 0) or 0),
+                    float(pnl_record.get('avgEntryPrice', 0) or 0),
+                    float(pnl_record.get('avgExitPrice', 0) or 0),
+                    pnl_record.get('takeProfit', 0) or 0,
+                    pnl_record.get('stopLoss', 0) or 0,
+                    float(pnl_record.get('closedPnl', 0) or 0),
+                    pnl_record.get('execType', ''),
+                    int(pnl_record.get('createdTime', 0))
+                )
                 logging.info(",".join(row))
-            
-            self.bybit_client.last_closed_pnl_time_ms = int(closed_positions[-1]['createdTime']) + 1
+
             logging.info("-" * 80)
 
         except Exception as e:
-            logging.error(f"Error al exportar operaciones cerradas: {e}")
\ No newline at end of file
+            logging.error("Error al exportar operaciones cerradas: %s", e)
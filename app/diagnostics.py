@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import cProfile
+import threading
+import traceback
+import tracemalloc
+from datetime import datetime, timezone
+
+# Límites superiores (ms) de los buckets del histograma de lag del event loop
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class LoopLagMonitor:
+    """
+    Mide el lag del event loop y detecta bloqueos.
+
+    Una corrutina duerme ``interval`` y mide cuánto tarda realmente en despertar;
+    la diferencia es el lag, que se acumula en un histograma de buckets fijos y se
+    reporta periódicamente. Un hilo watchdog vigila el heartbeat de esa corrutina:
+    si el loop lleva más de ``threshold`` sin avanzar, captura la pila del hilo del
+    loop para registrar qué código lo está bloqueando (p. ej. una llamada REST
+    síncrona) mientras el bloqueo todavía está ocurriendo.
+    """
+
+    def __init__(self):
+        self.interval = float(os.getenv('LOOP_LAG_INTERVAL_MS', '100')) / 1000
+        self.threshold = float(os.getenv('LOOP_LAG_THRESHOLD_MS', '250')) / 1000
+        self.report_interval = float(os.getenv('LOOP_LAG_REPORT_SECONDS', '60'))
+
+        self.bucket_counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+        self._heartbeat = time.monotonic()
+        self._loop = None
+        self._loop_thread_id = None
+        self._stall_reported = False
+        self._watchdog = None
+
+    def record(self, lag):
+        """Agrega una muestra de lag (segundos) al histograma."""
+        lag_ms = lag * 1000
+        index = len(LAG_BUCKETS_MS)
+        for i, upper in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= upper:
+                index = i
+                break
+        self.bucket_counts[index] += 1
+        self.samples += 1
+        self.total_lag += lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+    def snapshot(self):
+        """Devuelve las estadísticas acumuladas y reinicia el histograma."""
+        stats = {
+            'samples': self.samples,
+            'avg_ms': (self.total_lag / self.samples * 1000) if self.samples else 0.0,
+            'max_ms': self.max_lag * 1000,
+            'buckets': dict(zip([f"<={b}ms" for b in LAG_BUCKETS_MS] + [f">{LAG_BUCKETS_MS[-1]}ms"], self.bucket_counts)),
+        }
+        self.bucket_counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        return stats
+
+    async def run(self):
+        """Bucle de muestreo del lag del event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._start_watchdog()
+
+        logging.info("Monitor de lag del event loop iniciado - Intervalo: %.0fms, Umbral: %.0fms",
+                     self.interval * 1000, self.threshold * 1000)
+
+        last_report = time.monotonic()
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+
+            self._heartbeat = now
+            self._stall_reported = False
+            self.record(lag)
+
+            if lag > self.threshold:
+                logging.warning("⏱️ Lag del event loop: %.0fms (umbral %.0fms)", lag * 1000, self.threshold * 1000)
+
+            if now - last_report >= self.report_interval:
+                last_report = now
+                stats = self.snapshot()
+                logging.info("⏱️ Lag del event loop - Muestras: %d, Media: %.1fms, Máx: %.1fms, Histograma: %s",
+                             stats['samples'], stats['avg_ms'], stats['max_ms'], stats['buckets'])
+
+    def _start_watchdog(self):
+        if self._watchdog is not None:
+            return
+        self._watchdog = threading.Thread(target=self._watchdog_loop, name='loop-lag-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def _watchdog_loop(self):
+        """Hilo que detecta bloqueos del loop y registra la pila culpable."""
+        while True:
+            time.sleep(self.interval)
+            stalled_for = time.monotonic() - self._heartbeat - self.interval
+            if stalled_for <= self.threshold or self._stall_reported:
+                continue
+
+            self._stall_reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            logging.warning("🐢 Event loop bloqueado durante %.0fms por la tarea %s. Pila del hilo del loop:\n%s",
+                            stalled_for * 1000, self._current_task_name(), stack)
+
+    def _current_task_name(self):
+        """Nombre de la corrutina que tiene el control del loop en este momento."""
+        try:
+            task = asyncio.current_task(self._loop)
+        except Exception:
+            return '?'
+        if task is None:
+            return '(ninguna: callback del loop)'
+        coro = task.get_coro()
+        return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+
+class ProfilingHooks:
+    """
+    Profiling activable en caliente mediante señales, sin reiniciar el bot.
+
+    - SIGUSR1: inicia cProfile; la siguiente SIGUSR1 lo detiene y escribe un
+      archivo ``.prof`` (analizable con ``python -m pstats`` o snakeviz).
+    - SIGUSR2: toma un snapshot de ``tracemalloc`` (lo activa en la primera
+      señal), lo escribe a disco y registra el top de asignaciones y la
+      diferencia respecto al snapshot anterior.
+
+    Los archivos se escriben en PROFILE_DIR (default ``profiles``).
+    """
+
+    def __init__(self):
+        self.output_dir = os.getenv('PROFILE_DIR', 'profiles')
+        self.top_n = int(os.getenv('TRACEMALLOC_TOP', '15'))
+        self._profiler = None
+        self._last_snapshot = None
+
+    def install(self, loop):
+        """Registra los handlers de señal en el event loop (solo Unix)."""
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, self.toggle_cpu_profile)
+            loop.add_signal_handler(signal.SIGUSR2, self.take_memory_snapshot)
+        except (NotImplementedError, AttributeError, RuntimeError) as e:
+            logging.warning("No se pudieron instalar los hooks de profiling: %s", e)
+            return False
+
+        logging.info("Hooks de profiling instalados (SIGUSR1: cProfile, SIGUSR2: tracemalloc) - Salida: %s",
+                     self.output_dir)
+        return True
+
+    def _output_path(self, prefix, extension):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        return os.path.join(self.output_dir, f"{prefix}-{stamp}-{os.getpid()}.{extension}")
+
+    def toggle_cpu_profile(self):
+        """Inicia o detiene cProfile y vuelca el resultado a disco."""
+        try:
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+                logging.info("🔬 cProfile iniciado (envía SIGUSR1 de nuevo para detener)")
+                return
+
+            self._profiler.disable()
+            path = self._output_path('cprofile', 'prof')
+            self._profiler.dump_stats(path)
+            self._profiler = None
+            logging.info("🔬 cProfile detenido - Resultado escrito en %s", path)
+        except Exception as e:
+            self._profiler = None
+            logging.error("Error en el profiling de CPU: %s", e)
+
+    def take_memory_snapshot(self):
+        """Toma un snapshot de tracemalloc y registra las mayores asignaciones."""
+        try:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(int(os.getenv('TRACEMALLOC_FRAMES', '1')))
+                logging.info("🧠 tracemalloc iniciado (envía SIGUSR2 de nuevo para tomar un snapshot)")
+                return
+
+            snapshot = tracemalloc.take_snapshot()
+            path = self._output_path('tracemalloc', 'snapshot')
+            snapshot.dump(path)
+
+            if self._last_snapshot is not None:
+                stats = snapshot.compare_to(self._last_snapshot, 'lineno')
+                title = "diferencia respecto al snapshot anterior"
+            else:
+                stats = snapshot.statistics('lineno')
+                title = "mayores asignaciones"
+            self._last_snapshot = snapshot
+
+            lines = '\n'.join(str(stat) for stat in stats[:self.top_n])
+            current, peak = tracemalloc.get_traced_memory()
+            logging.info("🧠 Snapshot de tracemalloc escrito en %s - Actual: %.1f MiB, Pico: %.1f MiB - Top %d (%s):\n%s",
+                         path, current / 2**20, peak / 2**20, self.top_n, title, lines)
+        except Exception as e:
+            logging.error("Error tomando snapshot de memoria: %s", e)
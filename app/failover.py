@@ -0,0 +1,287 @@
+import os
+import json
+import fcntl
+import socket
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+
+class LeaseBackend(ABC):
+    """
+    Interfaz de lease para el modo activo/standby.
+
+    Solo la instancia que tiene el lease gestiona stops. Un backend distribuido
+    (Redis, DynamoDB, etcd...) implementa estos tres métodos con un TTL; FileLease
+    es el sustituto local basado en un lock de archivo.
+    """
+
+    @abstractmethod
+    def try_acquire(self):
+        """Intenta obtener el lease sin bloquear. Devuelve True si se obtuvo."""
+
+    @abstractmethod
+    def renew(self):
+        """Renueva el lease. Devuelve False si se perdió."""
+
+    @abstractmethod
+    def release(self):
+        """Libera el lease."""
+
+
+class FileLease(LeaseBackend):
+    """
+    Lease local con ``flock`` sobre un archivo compartido (p. ej. un volumen Docker
+    montado por ambas instancias). El kernel libera el lock cuando el proceso
+    activo muere, por lo que el standby puede tomar el control en el siguiente
+    sondeo. El archivo guarda el id del titular y su último heartbeat.
+    """
+
+    def __init__(self, path, holder_id):
+        self.path = path
+        self.holder_id = holder_id
+        self._fd = None
+
+    def try_acquire(self):
+        if self._fd is not None:
+            return True
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        self._fd = fd
+        self._write_heartbeat()
+        return True
+
+    def renew(self):
+        if self._fd is None:
+            return False
+        try:
+            self._write_heartbeat()
+            return True
+        except OSError as e:
+            logging.error("Error renovando el lease: %s", e)
+            return False
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def _write_heartbeat(self):
+        payload = json.dumps({
+            'holder': self.holder_id,
+            'heartbeat': datetime.now(timezone.utc).isoformat()
+        }).encode()
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, payload, 0)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class StateJournal:
+    """
+    Stream de estado de los pools escrito por la instancia activa.
+
+    Es un archivo JSON lines: empieza con un snapshot completo de ambos pools y
+    sigue con operaciones ``upsert``/``remove`` por símbolo. Cada
+    ``compact_every`` operaciones se reescribe de forma atómica con un snapshot
+    nuevo (os.replace), de modo que el archivo no crece indefinidamente.
+    """
+
+    def __init__(self, path, compact_every=1000):
+        self.path = path
+        self.compact_every = compact_every
+        self._file = None
+        self._ops_since_snapshot = 0
+        self._monitoring_pool = None
+        self._active_trailing_pool = None
+
+    @property
+    def is_open(self):
+        return self._file is not None
+
+    def open(self, monitoring_pool, active_trailing_pool):
+        """Empieza a publicar el estado de los pools indicados."""
+        self._monitoring_pool = monitoring_pool
+        self._active_trailing_pool = active_trailing_pool
+        self.snapshot()
+
+    def snapshot(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as tmp:
+            tmp.write(json.dumps({
+                'op': 'snapshot',
+                'monitoring': self._monitoring_pool,
+                'active': self._active_trailing_pool
+            }, default=_encode_value) + '\n')
+        os.replace(tmp_path, self.path)
+
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, 'a')
+        self._ops_since_snapshot = 0
+
+    def upsert(self, pool, symbol, data):
+        self._append({'op': 'upsert', 'pool': pool, 'symbol': symbol, 'data': data})
+
+    def remove(self, symbol):
+        self._append({'op': 'remove', 'symbol': symbol})
+
+    def _append(self, record):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(record, default=_encode_value) + '\n')
+        self._file.flush()
+
+        self._ops_since_snapshot += 1
+        if self._ops_since_snapshot >= self.compact_every:
+            self.snapshot()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StateTail:
+    """
+    Lector del StateJournal para la instancia standby: sigue el archivo y mantiene
+    una copia caliente de ambos pools. Detecta la compactación (cambio de inodo o
+    archivo más corto) y vuelve a leer desde el snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.monitoring_pool = {}
+        self.active_trailing_pool = {}
+        self._file = None
+        self._inode = None
+        self._partial = ''
+
+    def poll(self):
+        """Aplica las operaciones nuevas del journal. Devuelve cuántas se aplicaron."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+
+        if self._file is None or stat.st_ino != self._inode or stat.st_size < self._file.tell():
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, 'r')
+            self._inode = os.fstat(self._file.fileno()).st_ino
+            self._partial = ''
+
+        chunk = self._file.read()
+        if not chunk:
+            return 0
+
+        lines = (self._partial + chunk).split('\n')
+        # La última línea puede estar a medio escribir
+        self._partial = lines.pop()
+
+        applied = 0
+        for line in lines:
+            if not line:
+                continue
+            try:
+                self._apply(json.loads(line))
+                applied += 1
+            except (ValueError, KeyError) as e:
+                logging.warning("Línea inválida en el journal de estado: %s", e)
+        return applied
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'snapshot':
+            self.monitoring_pool = record['monitoring']
+            self.active_trailing_pool = record['active']
+        elif op == 'upsert':
+            symbol = record['symbol']
+            if record['pool'] == 'active':
+                self.monitoring_pool.pop(symbol, None)
+                self.active_trailing_pool[symbol] = record['data']
+            else:
+                self.active_trailing_pool.pop(symbol, None)
+                self.monitoring_pool[symbol] = record['data']
+        elif op == 'remove':
+            self.monitoring_pool.pop(record['symbol'], None)
+            self.active_trailing_pool.pop(record['symbol'], None)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class FailoverCoordinator:
+    """
+    Coordina el modo activo/standby.
+
+    En standby sondea el lease cada FAILOVER_POLL_SECONDS mientras sigue el journal
+    de la instancia activa; al obtener el lease devuelve los pools calientes para
+    que el StrategyManager arranque sin reconstruir el estado ni reenviar los SL.
+    Como activa, renueva el lease y publica el estado en el journal.
+    """
+
+    def __init__(self, lease=None):
+        self.holder_id = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_path = os.getenv('FAILOVER_LEASE_PATH', 'state/leader.lock')
+        self.state_path = os.getenv('FAILOVER_STATE_PATH', 'state/trailing_state.jsonl')
+        self.poll_seconds = float(os.getenv('FAILOVER_POLL_SECONDS', '1'))
+
+        self.lease = lease or FileLease(self.lease_path, self.holder_id)
+        self.journal = StateJournal(self.state_path)
+
+    async def wait_for_leadership(self):
+        """
+        Espera (como standby) hasta obtener el lease. Devuelve el StateTail con la
+        última copia de los pools publicada por la instancia activa.
+        """
+        tail = StateTail(self.state_path)
+
+        if not self.lease.try_acquire():
+            logging.info("🕒 Instancia %s en standby - esperando el lease (%s)", self.holder_id, self.lease_path)
+            while not self.lease.try_acquire():
+                tail.poll()
+                await asyncio.sleep(self.poll_seconds)
+
+        tail.poll()
+        tail.close()
+
+        logging.info("👑 Instancia %s activa - Estado heredado: Monitoreo: %d, Trailing: %d",
+                     self.holder_id, len(tail.monitoring_pool), len(tail.active_trailing_pool))
+        return tail
+
+    async def run(self):
+        """Renueva el lease mientras la instancia está activa."""
+        try:
+            while True:
+                await asyncio.sleep(self.poll_seconds)
+                if not self.lease.renew():
+                    raise RuntimeError(f"Lease perdido por la instancia {self.holder_id}")
+        finally:
+            self.journal.close()
+            self.lease.release()
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from decimal import Decimal
+from datetime import datetime, timezone
+
+DEFAULT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DEFAULT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Descarta mensajes repetitivos que comparten la misma clave de rate limiting.
+
+    Solo afecta a los registros emitidos con ``extra={'rate_key': ...}``; el resto
+    pasa siempre. Por cada clave se deja pasar como máximo un mensaje por intervalo
+    y se anota cuántos se suprimieron en el atributo ``suppressed`` del siguiente.
+    """
+
+    def __init__(self, interval_seconds=5.0):
+        super().__init__()
+        self.interval_seconds = interval_seconds
+        self._last_emit = {}
+        self._suppressed = {}
+
+    def filter(self, record):
+        key = getattr(record, 'rate_key', None)
+        if key is None or self.interval_seconds <= 0:
+            return True
+
+        now = time.monotonic()
+        last = self._last_emit.get(key)
+        if last is not None and now - last < self.interval_seconds:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return False
+
+        self._last_emit[key] = now
+        record.suppressed = self._suppressed.pop(key, 0)
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """Formato de texto plano que indica cuántos mensajes repetidos se suprimieron."""
+
+    def format(self, record):
+        message = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            message = f"{message} (+{suppressed} similares suprimidos)"
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON."""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        rate_key = getattr(record, 'rate_key', None)
+        if rate_key is not None:
+            payload['rate_key'] = rate_key
+            if getattr(record, 'suppressed', 0):
+                payload['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no formatea el mensaje en el hilo del bot.
+
+    El QueueHandler estándar llama a ``format()`` antes de encolar; aquí solo se
+    resuelve la traza de excepción (que no es serializable de forma diferida) y
+    el formateo real se hace en el hilo del QueueListener.
+
+    Diferir el formateo solo es seguro con argumentos inmutables: si algún
+    argumento no es un escalar (p. ej. un dict de los pools), el mensaje se
+    renderiza aquí, para que el log refleje el estado en el momento de la llamada
+    y el ``__repr__`` del objeto no corra en el hilo del listener.
+    """
+
+    def prepare(self, record):
+        if record.args and not _scalar_args(record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_SCALAR_TYPES = (str, int, float, bool, type(None), bytes, Decimal, datetime)
+
+
+def _scalar_args(args):
+    # Un único dict como argumento llega como ``record.args`` (LogRecord lo
+    # desempaqueta), así que un mapping siempre es un objeto vivo
+    if not isinstance(args, tuple):
+        return False
+    return all(type(arg) in _SCALAR_TYPES for arg in args)
+
+
+_listener = None
+
+
+def setup_logging():
+    """
+    Configura el logging del bot a través de un pipeline QueueHandler/QueueListener.
+
+    Los handlers de salida (stream) corren en el hilo del listener, de modo que el
+    event loop solo paga el coste de encolar el registro. Variables de entorno:
+
+    - LOG_LEVEL: nivel mínimo (default INFO)
+    - LOG_FORMAT: 'text' (default) o 'json'
+    - LOG_RATE_LIMIT_SECONDS: intervalo mínimo entre mensajes con la misma
+      ``rate_key`` (default 5; 0 desactiva el rate limiting)
+    """
+    global _listener
+
+    if _listener is not None:
+        return _listener
+
+    level_name = os.getenv('LOG_LEVEL', 'INFO').upper()
+    level = getattr(logging, level_name, logging.INFO)
+    log_format = os.getenv('LOG_FORMAT', 'text').lower()
+    rate_limit_seconds = float(os.getenv('LOG_RATE_LIMIT_SECONDS', '5'))
+
+    stream_handler = logging.StreamHandler()
+    if log_format == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter(DEFAULT_FORMAT, datefmt=DEFAULT_DATEFMT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(log_queue)
+    # El filtro va en el handler del hilo del bot para descartar antes de encolar
+    queue_handler.addFilter(RateLimitFilter(rate_limit_seconds))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    return _listener
+
+
+def shutdown_logging():
+    """Vacía la cola de logs y detiene el hilo del listener."""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -4,33 +4,71 @@ import logging
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 
+from log_config import setup_logging, shutdown_logging
 from bybit_client import BybitClient
 from strategy_manager import StrategyManager
 from data_logger import DataLogger
+from diagnostics import LoopLagMonitor, ProfilingHooks
+from volatility_engine import VolatilityEngine
+from failover import FailoverCoordinator
+from trade_analytics import TradeAnalytics
 
-# Configuración básica de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+async def main(bybit_client=None):
+    """
+    Función principal que inicia el bot.
+    
+    Args:
+        bybit_client: Cliente a usar en lugar de BybitClient (p. ej. el exchange
+            simulado de soak_harness.py)
+    """
+    # Cargar variables de entorno
+    load_dotenv(dotenv_path='.env.dev')
 
-async def main():
-    """Función principal que inicia el bot."""
+    # Logging asíncrono (QueueHandler/QueueListener) fuera del event loop
+    setup_logging()
     logging.info("Iniciando Bybit Trailing Stop Bot...")
 
-    # Cargar variables de entorno
-    load_dotenv(dotenv_path='.env.dev')
+    # Profiling activable en caliente por señales (SIGUSR1 / SIGUSR2). Se instala
+    # antes de esperar el lease: sin handler, la señal terminaría el proceso standby
+    ProfilingHooks().install(asyncio.get_running_loop())
+
+    # El lag del loop también se mide mientras la instancia está en standby
+    lag_monitor_task = None
+    if os.getenv('LOOP_LAG_MONITOR', 'true').lower() == 'true':
+        lag_monitor_task = asyncio.ensure_future(LoopLagMonitor().run())
 
     # Crear una instancia del cliente de Bybit
-    bybit_client = BybitClient()
+    if bybit_client is None:
+        bybit_client = BybitClient()
 
     # Crear una cola de mensajes para comunicar eventos entre tareas
     event_queue = asyncio.Queue()
+    
+    # Cola propia del DataLogger: ejecuciones (registro de operaciones), órdenes
+    # (cancelaciones de cierres parciales) y posiciones (precios de entrada)
+    trade_event_queue = asyncio.Queue()
+    bybit_client.add_event_queue(trade_event_queue, topics=('execution', 'order', 'position'))
 
+    # Modo activo/standby: el standby espera aquí hasta obtener el lease
+    failover = None
+    inherited_state = None
+    if os.getenv('FAILOVER_ENABLED', 'false').lower() == 'true':
+        failover = FailoverCoordinator()
+        inherited_state = await failover.wait_for_leadership()
+    
     # Crear instancias de las clases de lógica separadas
-    strategy_manager = StrategyManager(bybit_client)
-    data_logger = DataLogger(bybit_client, event_queue)
+    volatility_engine = None
+    if os.getenv('VOLATILITY_TRAILING_ENABLED', 'false').lower() == 'true':
+        volatility_engine = VolatilityEngine(bybit_client)
+
+    strategy_manager = StrategyManager(bybit_client, volatility_engine, failover.journal if failover else None)
+    if inherited_state is not None:
+        strategy_manager.restore_state(inherited_state.monitoring_pool, inherited_state.active_trailing_pool)
+    analytics = None
+    if os.getenv('ANALYTICS_ENABLED', 'true').lower() == 'true':
+        analytics = TradeAnalytics()
+
+    data_logger = DataLogger(bybit_client, trade_event_queue, analytics)
 
     # Iniciar las tareas de forma concurrente
     tasks = [
@@ -39,13 +77,24 @@ async def main():
         data_logger.run(),
     ]
 
+    if lag_monitor_task is not None:
+        tasks.append(lag_monitor_task)
+    
+    if analytics is not None:
+        tasks.append(analytics.run())
+    
+    if failover is not None:
+        tasks.append(failover.run())
+
     try:
         await asyncio.gather(*tasks)
     except KeyboardInterrupt:
         logging.info("Bot detenido por el usuario.")
     except Exception as e:
-        logging.error(f"Se ha producido un error crítico: {e}")
+        logging.error("Se ha producido un error crítico: %s", e)
         logging.exception(e)
+    finally:
+        shutdown_logging()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
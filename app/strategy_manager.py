@@ -1,25 +1,44 @@
 import asyncio
 import logging
+import math
 import os
+import time
+from decimal import ROUND_CEILING, ROUND_FLOOR
 from datetime import datetime, timezone
 
 class StrategyManager:
     """Gestiona la estrategia de trailing stop basada en umbrales de PnL."""
     
-    def __init__(self, bybit_client):
+    def __init__(self, bybit_client, volatility_engine=None, state_journal=None):
         self.bybit_client = bybit_client
+
+        # Motor de volatilidad opcional (distancias de trailing basadas en ATR)
+        self.volatility_engine = volatility_engine
+        
+        # Journal de estado opcional para el modo activo/standby (ver failover.py)
+        self.state_journal = state_journal
         
         # Configuración desde variables de entorno
         self.trailing_activation_percent = float(os.getenv('TRAILING_ACTIVATION_PERCENT', '0.30'))
         self.trailing_increment_percent = float(os.getenv('TRAILING_INCREMENT_PERCENT', '0.50'))
         
+        # Modo de trailing: 'client' (el bot mueve el SL) o 'exchange' (trailing stop nativo de Bybit)
+        self.trailing_mode = os.getenv('TRAILING_MODE', 'client').lower()
+        self.native_confirm_seconds = float(os.getenv('NATIVE_TRAILING_CONFIRM_SECONDS', '10'))
+        
         # Pool de monitoreo: posiciones que aún no han alcanzado el umbral
         self.monitoring_pool = {}
         
         # Pool de trailing activo: posiciones con trailing stop activado
         self.active_trailing_pool = {}
         
-        logging.info(f"StrategyManager iniciado - Activación: {self.trailing_activation_percent}%, Incremento: {self.trailing_increment_percent}%")
+        # Órdenes de cierre en curso (stream de ejecuciones), por orderId
+        self.closing_orders = {}
+        
+        # Último seq de cierre por símbolo: los pushes de posición anteriores se descartan
+        self.closed_seq = {}
+        
+        logging.info("StrategyManager iniciado - Activación: %s%%, Incremento: %s%%, Modo: %s", self.trailing_activation_percent, self.trailing_increment_percent, self.trailing_mode)
 
     async def run_position_manager(self):
         """
@@ -30,6 +49,10 @@ class StrategyManager:
         # Cargar posiciones iniciales
         await self._load_initial_positions()
         
+        # Publicar el estado de los pools para la instancia standby
+        if self.state_journal is not None:
+            self.state_journal.open(self.monitoring_pool, self.active_trailing_pool)
+        
         while True:
             try:
                 # Procesar eventos de la cola del WebSocket
@@ -37,20 +60,48 @@ class StrategyManager:
                 
                 if event['topic'] == 'position':
                     await self._process_position_event(event['data'])
+                elif event['topic'] == 'execution':
+                    await self._process_execution_event(event['data'])
+                elif event['topic'] == 'order':
+                    await self._process_order_event(event['data'])
                 elif event['topic'] == 'wallet':
-                    logging.debug(f"Evento de wallet recibido (ignorado por ahora)")
+                    logging.debug("Evento de wallet recibido (ignorado por ahora)")
                 
                 self.bybit_client.event_queue.task_done()
                 
             except Exception as e:
-                logging.error(f"Error en el gestor de posiciones: {e}")
+                logging.error("Error en el gestor de posiciones: %s", e)
                 logging.exception(e)
             
-            await asyncio.sleep(0.1)
+            # Cede el turno al resto de tareas sin limitar el ritmo de eventos
+            await asyncio.sleep(0)
+
+    def restore_state(self, monitoring_pool, active_trailing_pool):
+        """
+        Restaura los pools heredados de otra instancia (failover). Las posiciones
+        restauradas se concilian en _load_initial_positions sin reenviar sus SL.
+        """
+        for position in active_trailing_pool.values():
+            if isinstance(position.get('last_sl_update'), str):
+                position['last_sl_update'] = datetime.fromisoformat(position['last_sl_update'])
+            position.setdefault('trailing_mode', 'client')
+            if position['trailing_mode'] == 'exchange':
+                # El reloj monotónico no es comparable entre procesos
+                position['native_set_at'] = time.monotonic()
+        
+        self.monitoring_pool.update(monitoring_pool)
+        self.active_trailing_pool.update(active_trailing_pool)
+        
+        logging.info("♻️ Estado restaurado - Monitoreo: %d, Trailing: %d",
+                     len(self.monitoring_pool), len(self.active_trailing_pool))
 
     async def _load_initial_positions(self):
         """
         Carga las posiciones abiertas al iniciar el bot y las agrega al monitoring_pool.
+        
+        Las posiciones que ya están en el active_trailing_pool (estado restaurado por
+        failover) conservan su trailing: se adopta el SL que reporta Bybit y no se
+        vuelve a llamar a set_trading_stop.
         """
         logging.info("Cargando posiciones abiertas iniciales...")
         
@@ -62,6 +113,7 @@ class StrategyManager:
                 return
             
             positions = response['result'].get('list', [])
+            open_symbols = set()
             
             for pos in positions:
                 size = float(pos.get('size', 0))
@@ -73,11 +125,19 @@ class StrategyManager:
                     entry_price = float(pos['avgPrice'])
                     unrealized_pnl = float(pos.get('unrealisedPnl', 0))
                     mark_price = float(pos.get('markPrice', entry_price))
+                    open_symbols.add(symbol)
                     
                     # Calcular PnL en porcentaje
                     pnl_percent = self._calculate_pnl_percent(entry_price, mark_price, side)
                     
-                    logging.info(f"Posición inicial encontrada: {symbol} {side} - Size: {size}, Entry: {entry_price}, PnL: {unrealized_pnl:.2f} USD ({pnl_percent:.2f}%)")
+                    self._track_volatility(symbol)
+                    
+                    # Posición con trailing heredado de la instancia anterior
+                    if symbol in self.active_trailing_pool and \
+                       self._adopt_restored_position(symbol, pos, size, mark_price):
+                        continue
+                    
+                    logging.info("Posición inicial encontrada: %s %s - Size: %s, Entry: %s, PnL: %.2f USD (%.2f%%)", symbol, side, size, entry_price, unrealized_pnl, pnl_percent)
                     
                     # Verificar si ya alcanzó el umbral
                     if pnl_percent >= self.trailing_activation_percent:
@@ -86,6 +146,7 @@ class StrategyManager:
                             'symbol': symbol,
                             'side': side,
                             'size': size,
+                            'seq': self._seq(pos),
                             'entry_price': entry_price,
                             'current_price': mark_price,
                             'unrealized_pnl': unrealized_pnl
@@ -94,19 +155,92 @@ class StrategyManager:
                         # Agregar al pool de monitoreo
                         self.monitoring_pool[symbol] = {
                             'size': size,
+                            'seq': self._seq(pos),
                             'side': side,
                             'entry_price': entry_price,
                             'initial_pnl_usd': unrealized_pnl,
                             'initial_pnl_percent': pnl_percent
                         }
-                        logging.info(f"✓ {symbol} agregado al pool de monitoreo (PnL: {pnl_percent:.2f}%)")
+                        logging.info("✓ %s agregado al pool de monitoreo (PnL: %.2f%%)", symbol, pnl_percent)
             
-            logging.info(f"Carga completada - Monitoreo: {len(self.monitoring_pool)}, Trailing activo: {len(self.active_trailing_pool)}")
+            # Descartar posiciones restauradas que se cerraron durante el traspaso
+            for symbol in [s for s in self.monitoring_pool if s not in open_symbols]:
+                del self.monitoring_pool[symbol]
+            for symbol in [s for s in self.active_trailing_pool if s not in open_symbols]:
+                del self.active_trailing_pool[symbol]
+            
+            logging.info("Carga completada - Monitoreo: %d, Trailing activo: %d", len(self.monitoring_pool), len(self.active_trailing_pool))
             
         except Exception as e:
-            logging.error(f"Error cargando posiciones iniciales: {e}")
+            logging.error("Error cargando posiciones iniciales: %s", e)
             logging.exception(e)
 
+    def _adopt_restored_position(self, symbol, pos, size, mark_price):
+        """
+        Concilia una posición restaurada con los datos actuales de Bybit. Si el
+        exchange confirma el stop (``stopLoss`` o, en modo exchange,
+        ``trailingStop``) solo se actualiza el estado local; si no, se vuelve a
+        colocar a partir del SL heredado.
+        
+        Si el lado o el precio de entrada no coinciden, la posición se cerró y se
+        volvió a abrir durante el traspaso: se descarta el estado heredado y se
+        devuelve False para tratarla como una posición nueva.
+        """
+        position = self.active_trailing_pool[symbol]
+        entry_price = float(pos['avgPrice'])
+        
+        if pos['side'] != position['side'] or \
+           not math.isclose(entry_price, float(position['entry_price']), rel_tol=1e-9):
+            logging.warning("♻️ %s cambió durante el traspaso (%s @ %s → %s @ %s), se descarta el trailing heredado",
+                            symbol, position['side'], position['entry_price'], pos['side'], entry_price)
+            del self.active_trailing_pool[symbol]
+            return False
+        
+        position['size'] = size
+        position['seq'] = self._seq(pos)
+        position['current_price'] = mark_price
+        
+        exchange_sl = float(pos.get('stopLoss') or 0)
+        native_active = float(pos.get('trailingStop') or 0) > 0
+        
+        if position['trailing_mode'] == 'exchange' and native_active:
+            position['native_confirmed'] = True
+            if exchange_sl > 0:
+                position['current_sl'] = exchange_sl
+        elif position['trailing_mode'] == 'exchange' and \
+                self._set_native_trailing_stop(symbol, pos['side'], mark_price,
+                                               self._tighter_sl(pos['side'], position['current_sl'], exchange_sl)):
+            logging.warning("♻️ %s sin trailing nativo en Bybit, se reenvía desde el estado heredado", symbol)
+        elif exchange_sl > 0:
+            position['trailing_mode'] = 'client'
+            position['current_sl'] = exchange_sl
+        else:
+            # El journal puede registrar un SL que nunca llegó a colocarse
+            logging.warning("♻️ %s sin SL en Bybit, se reenvía el SL heredado: %s", symbol, position['current_sl'])
+            position['trailing_mode'] = 'client'
+            self.bybit_client.set_trading_stop(symbol, position['current_sl'])
+        
+        logging.info("♻️ %s conserva el trailing heredado - SL: %s, Modo: %s",
+                     symbol, position['current_sl'], position['trailing_mode'])
+        self._publish_state(symbol)
+        return True
+
+    def _publish_state(self, symbol):
+        """
+        Publica en el journal de estado el estado actual de un símbolo (o su baja).
+        """
+        if self.state_journal is None or not self.state_journal.is_open:
+            return
+        try:
+            if symbol in self.active_trailing_pool:
+                self.state_journal.upsert('active', symbol, self.active_trailing_pool[symbol])
+            elif symbol in self.monitoring_pool:
+                self.state_journal.upsert('monitoring', symbol, self.monitoring_pool[symbol])
+            else:
+                self.state_journal.remove(symbol)
+        except Exception as e:
+            logging.error("Error publicando el estado de %s: %s", symbol, e)
+
     async def _process_position_event(self, event_data):
         """
         Procesa eventos de actualización de posiciones desde el WebSocket.
@@ -118,6 +252,8 @@ class StrategyManager:
             else:
                 positions = [event_data]
             
+            debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+
             for pos_data in positions:
                 symbol = pos_data.get('symbol')
                 size = float(pos_data.get('size', 0))
@@ -125,6 +261,11 @@ class StrategyManager:
                 if not symbol:
                     continue
                 
+                # Push anterior a un cierre ya detectado por ejecución u orden
+                seq = self._seq(pos_data)
+                if seq and seq <= self.closed_seq.get(symbol, 0):
+                    continue
+                
                 # Si la posición está cerrada (size = 0)
                 if size == 0:
                     await self._remove_position_from_pools(symbol)
@@ -139,21 +280,27 @@ class StrategyManager:
                 # Calcular PnL en porcentaje
                 pnl_percent = self._calculate_pnl_percent(entry_price, mark_price, side)
                 
-                logging.debug(f"Update: {symbol} - Price: {mark_price}, PnL: {unrealized_pnl:.2f} USD ({pnl_percent:.2f}%)")
+                if debug_enabled:
+                    logging.debug("Update: %s - Price: %s, PnL: %.2f USD (%.2f%%)", symbol, mark_price, unrealized_pnl, pnl_percent)
                 
                 # Determinar en qué pool está la posición
                 if symbol in self.active_trailing_pool:
                     # Ya tiene trailing stop activo, actualizar
+                    self.active_trailing_pool[symbol]['size'] = size
+                    self.active_trailing_pool[symbol]['seq'] = seq
+                    if self.active_trailing_pool[symbol]['trailing_mode'] == 'exchange':
+                        self._reconcile_native_trailing(symbol, pos_data)
                     await self._update_trailing_stop(symbol, mark_price, side)
                     
                 elif symbol in self.monitoring_pool:
                     # Está en monitoreo, verificar si alcanzó el umbral
                     if pnl_percent >= self.trailing_activation_percent:
-                        logging.info(f"🎯 {symbol} alcanzó umbral de activación ({pnl_percent:.2f}% >= {self.trailing_activation_percent}%)")
+                        logging.info("🎯 %s alcanzó umbral de activación (%.2f%% >= %s%%)", symbol, pnl_percent, self.trailing_activation_percent)
                         await self._activate_trailing_stop({
                             'symbol': symbol,
                             'side': side,
                             'size': size,
+                            'seq': seq,
                             'entry_price': entry_price,
                             'current_price': mark_price,
                             'unrealized_pnl': unrealized_pnl
@@ -161,18 +308,22 @@ class StrategyManager:
                     else:
                         # Actualizar datos en monitoring pool
                         self.monitoring_pool[symbol].update({
+                            'size': size,
+                            'seq': seq,
                             'initial_pnl_usd': unrealized_pnl,
                             'initial_pnl_percent': pnl_percent
                         })
                 else:
                     # Nueva posición detectada
-                    logging.info(f"🆕 Nueva posición detectada: {symbol} {side} - Size: {size}, Entry: {entry_price}")
+                    logging.info("🆕 Nueva posición detectada: %s %s - Size: %s, Entry: %s", symbol, side, size, entry_price)
+                    self._track_volatility(symbol)
                     
                     if pnl_percent >= self.trailing_activation_percent:
                         await self._activate_trailing_stop({
                             'symbol': symbol,
                             'side': side,
                             'size': size,
+                            'seq': seq,
                             'entry_price': entry_price,
                             'current_price': mark_price,
                             'unrealized_pnl': unrealized_pnl
@@ -180,15 +331,115 @@ class StrategyManager:
                     else:
                         self.monitoring_pool[symbol] = {
                             'size': size,
+                            'seq': seq,
                             'side': side,
                             'entry_price': entry_price,
                             'initial_pnl_usd': unrealized_pnl,
                             'initial_pnl_percent': pnl_percent
                         }
-                        logging.info(f"✓ {symbol} agregado al pool de monitoreo")
+                        logging.info("✓ %s agregado al pool de monitoreo", symbol)
+                        self._publish_state(symbol)
+        
+        except Exception as e:
+            logging.error("Error procesando evento de posición: %s", e)
+            logging.exception(e)
+
+    async def _process_execution_event(self, event_data):
+        """
+        Procesa ejecuciones del stream privado ``execution``.
+        
+        El tamaño de la posición solo lo escribe el stream de posiciones; aquí no se
+        descuenta nada de él. Cada orden de cierre acumula su ``closedSize`` junto
+        con el tamaño y el ``seq`` de posición conocidos en su primera ejecución. El
+        símbolo se elimina de los pools sin esperar al push con size = 0 solo si la
+        orden terminó (``leavesQty`` = 0), cubrió ese tamaño y ningún push posterior
+        a la orden se ha aplicado todavía (seq de la posición < seq de la ejecución).
+        En cualquier otro caso decide el stream de posiciones.
+        """
+        try:
+            if 'data' in event_data:
+                executions = event_data['data']
+            else:
+                executions = [event_data]
+            
+            for execution in executions:
+                if execution.get('execType') != 'Trade':
+                    continue
+                
+                symbol = execution.get('symbol')
+                order_id = execution.get('orderId')
+                closed_size = float(execution.get('closedSize') or 0)
+                if not symbol or not order_id or closed_size <= 0:
+                    continue
+                
+                position = self.active_trailing_pool.get(symbol) or self.monitoring_pool.get(symbol)
+                if position is None:
+                    continue
+                
+                exec_seq = self._seq(execution)
+                order = self.closing_orders.get(order_id)
+                if order is None:
+                    order = self.closing_orders[order_id] = {
+                        'symbol': symbol,
+                        'start_size': position['size'],
+                        'first_seq': exec_seq,
+                        'closed_size': 0.0
+                    }
+                order['closed_size'] += closed_size
+                
+                if float(execution.get('leavesQty') or 0) > 0:
+                    continue
+                del self.closing_orders[order_id]
+                
+                # Sin seq no se puede ordenar frente al stream de posiciones
+                if not exec_seq or not order['first_seq'] or position.get('seq', 0) >= order['first_seq']:
+                    continue
+                
+                if order['closed_size'] >= order['start_size'] * (1 - 1e-9):
+                    logging.info("⚡ Cierre de %s detectado por ejecución (%s @ %s, %s)",
+                                 symbol, order['closed_size'], execution.get('execPrice'),
+                                 execution.get('stopOrderType') or execution.get('orderType'))
+                    self.closed_seq[symbol] = exec_seq
+                    await self._remove_position_from_pools(symbol)
+        
+        except Exception as e:
+            logging.error("Error procesando evento de ejecución: %s", e)
+            logging.exception(e)
+
+    async def _process_order_event(self, event_data):
+        """
+        Procesa órdenes del stream privado ``order``. Un stop loss o trailing stop
+        completado cierra la posición completa, así que el símbolo se elimina de los
+        pools en cuanto llega la orden en estado Filled.
+        """
+        try:
+            if 'data' in event_data:
+                orders = event_data['data']
+            else:
+                orders = [event_data]
+            
+            for order in orders:
+                status = order.get('orderStatus')
+                if status in ('Cancelled', 'PartiallyFilledCanceled', 'Rejected', 'Deactivated'):
+                    # La orden no completó el cierre: deja de seguirse
+                    self.closing_orders.pop(order.get('orderId'), None)
+                    continue
+                
+                if status != 'Filled':
+                    continue
+                
+                if order.get('stopOrderType') not in ('StopLoss', 'TrailingStop'):
+                    continue
+                
+                symbol = order.get('symbol')
+                if symbol:
+                    seq = self._seq(order)
+                    if seq:
+                        self.closed_seq[symbol] = max(seq, self.closed_seq.get(symbol, 0))
+                    await self._remove_position_from_pools(symbol)
         
         except Exception as e:
-            logging.error(f"Error procesando evento de posición: {e}")
+            logging.error("Error procesando evento de orden: %s", e)
             logging.exception(e)
 
     async def _activate_trailing_stop(self, position_data):
@@ -206,25 +457,108 @@ class StrategyManager:
             del self.monitoring_pool[symbol]
         
         # Calcular el Stop Loss inicial basado en el porcentaje de activación
-        initial_sl = self._calculate_initial_sl(entry_price, side)
+        initial_sl = self._calculate_initial_sl(entry_price, side, symbol)
         
         # Agregar al pool de trailing activo
         self.active_trailing_pool[symbol] = {
             'size': position_data['size'],
+            'seq': position_data.get('seq', 0),
             'side': side,
             'entry_price': entry_price,
             'current_price': current_price,
             'current_sl': initial_sl,
             'highest_price': current_price if side == 'Buy' else None,
             'lowest_price': current_price if side == 'Sell' else None,
-            'last_sl_update': datetime.now(timezone.utc)
+            'last_sl_update': datetime.now(timezone.utc),
+            'trailing_mode': 'client'
         }
         
-        # Establecer el Stop Loss en Bybit
-        self.bybit_client.set_trading_stop(symbol, initial_sl)
+        # Establecer el Stop Loss en Bybit (trailing nativo o SL gestionado por el bot)
+        if self.trailing_mode != 'exchange' or not self._set_native_trailing_stop(symbol, side, current_price, initial_sl):
+            self.bybit_client.set_trading_stop(symbol, initial_sl)
+        
+        logging.info("🔒 Trailing Stop ACTIVADO para %s - SL inicial: %s, Precio actual: %s, Modo: %s",
+                     symbol, initial_sl, current_price, self.active_trailing_pool[symbol]['trailing_mode'])
+        self._log_pool_counts()
+        self._publish_state(symbol)
+
+    def _set_native_trailing_stop(self, symbol, side, current_price, initial_sl):
+        """
+        Delega el trailing en Bybit: establece el SL inicial junto con los parámetros
+        nativos ``trailingStop`` (distancia en precio) y ``activePrice``, redondeados
+        al tick size. A partir de ahí el bot solo supervisa la posición.
+        
+        Devuelve False si Bybit rechaza la orden o no se puede redondear al tick, en
+        cuyo caso la posición sigue con trailing gestionado por el bot.
+        """
+        position = self.active_trailing_pool[symbol]
+        distance_percent = self._trailing_distance_percent(symbol, current_price)
+        
+        # El SL se redondea alejándose del precio (más conservador) y el precio de
+        # activación hacia el lado favorable, para que Bybit no lo rechace
+        sl_rounding = ROUND_FLOOR if side == 'Buy' else ROUND_CEILING
+        active_rounding = ROUND_CEILING if side == 'Buy' else ROUND_FLOOR
+        trailing_distance = self.bybit_client.round_to_tick(symbol, current_price * distance_percent / 100)
+        active_price = self.bybit_client.round_to_tick(symbol, current_price, active_rounding)
+        stop_loss = self.bybit_client.round_to_tick(symbol, initial_sl, sl_rounding)
+        
+        if trailing_distance is None or active_price is None or stop_loss is None:
+            logging.warning("⚠️ %s sin tick size conocido, usando trailing gestionado por el bot", symbol)
+            return False
+        
+        if trailing_distance <= 0:
+            trailing_distance = self.bybit_client.get_tick_size(symbol)
+        
+        response = self.bybit_client.set_trading_stop(
+            symbol, stop_loss, trailing_stop=trailing_distance, active_price=active_price
+        )
+        
+        if not response or response.get('retCode') != 0:
+            logging.warning("⚠️ Trailing stop nativo rechazado para %s, usando trailing gestionado por el bot", symbol)
+            return False
+        
+        position.update({
+            'trailing_mode': 'exchange',
+            'current_sl': float(stop_loss),
+            'native_trailing_distance': float(trailing_distance),
+            'native_set_at': time.monotonic(),
+            'native_confirmed': False
+        })
+        return True
+
+    def _reconcile_native_trailing(self, symbol, pos_data):
+        """
+        Concilia una posición con trailing nativo usando el stream de posiciones.
+        
+        Mientras Bybit reporte ``trailingStop`` > 0 solo se refleja el SL que mueve el
+        exchange. Si el trailing nativo desaparece (cancelado o rechazado tras el
+        envío) o no se confirma en NATIVE_TRAILING_CONFIRM_SECONDS, la posición pasa a
+        trailing gestionado por el bot.
+        """
+        position = self.active_trailing_pool[symbol]
+        trailing_stop = float(pos_data.get('trailingStop') or 0)
+        stop_loss = float(pos_data.get('stopLoss') or 0)
+        
+        if trailing_stop > 0:
+            position['native_confirmed'] = True
+            if stop_loss > 0 and stop_loss != position['current_sl']:
+                position['current_sl'] = stop_loss
+                position['last_sl_update'] = datetime.now(timezone.utc)
+                self._publish_state(symbol)
+            return
+        
+        if not position['native_confirmed'] and \
+           time.monotonic() - position['native_set_at'] < self.native_confirm_seconds:
+            # Todavía puede llegar un push anterior a la confirmación del exchange
+            return
         
-        logging.info(f"🔒 Trailing Stop ACTIVADO para {symbol} - SL inicial: {initial_sl}, Precio actual: {current_price}")
-        logging.info(f"📊 Pools actuales - Monitoreo: {len(self.monitoring_pool)}, Trailing: {len(self.active_trailing_pool)}")
+        logging.warning("⚠️ Trailing stop nativo ausente para %s, volviendo a trailing gestionado por el bot", symbol)
+        position['trailing_mode'] = 'client'
+        if stop_loss > 0:
+            position['current_sl'] = stop_loss
+        else:
+            self.bybit_client.set_trading_stop(symbol, position['current_sl'])
+        self._publish_state(symbol)
 
     async def _update_trailing_stop(self, symbol, current_price, side):
         """
@@ -238,8 +572,17 @@ class StrategyManager:
         # Actualizar precio actual
         position['current_price'] = current_price
         
+        # Con trailing nativo Bybit mueve el SL; solo se registran los extremos
+        if position['trailing_mode'] == 'exchange':
+            if side == 'Buy' and (position['highest_price'] is None or current_price > position['highest_price']):
+                position['highest_price'] = current_price
+            elif side == 'Sell' and (position['lowest_price'] is None or current_price < position['lowest_price']):
+                position['lowest_price'] = current_price
+            return
+        
         should_update_sl = False
         new_sl = None
+        increment_percent = self._trailing_distance_percent(symbol, current_price)
         
         if side == 'Buy':  # Posición LONG
             # Actualizar highest_price si es necesario
@@ -251,12 +594,12 @@ class StrategyManager:
             
             # El SL debe moverse cuando el precio suba un increment adicional
             threshold_for_sl_update = position['entry_price'] * (1 + (price_increase_percent / 100))
-            current_sl_threshold = position['current_sl'] * (1 + (self.trailing_increment_percent / 100))
+            current_sl_threshold = position['current_sl'] * (1 + (increment_percent / 100))
             
             if current_price >= current_sl_threshold:
                 should_update_sl = True
                 # Nuevo SL: precio actual menos el porcentaje de incremento
-                new_sl = current_price * (1 - (self.trailing_increment_percent / 100))
+                new_sl = current_price * (1 - (increment_percent / 100))
         
         elif side == 'Sell':  # Posición SHORT
             # Actualizar lowest_price si es necesario
@@ -266,12 +609,12 @@ class StrategyManager:
             # Verificar si el precio bajó suficiente para mover el SL
             price_decrease_percent = ((position['entry_price'] - current_price) / position['entry_price']) * 100
             
-            current_sl_threshold = position['current_sl'] * (1 - (self.trailing_increment_percent / 100))
+            current_sl_threshold = position['current_sl'] * (1 - (increment_percent / 100))
             
             if current_price <= current_sl_threshold:
                 should_update_sl = True
                 # Nuevo SL: precio actual más el porcentaje de incremento
-                new_sl = current_price * (1 + (self.trailing_increment_percent / 100))
+                new_sl = current_price * (1 + (increment_percent / 100))
         
         # Actualizar el SL si es necesario
         if should_update_sl and new_sl:
@@ -279,7 +622,7 @@ class StrategyManager:
             if (side == 'Buy' and new_sl > position['current_sl']) or \
                (side == 'Sell' and new_sl < position['current_sl']):
                 
-                logging.info(f"📈 Actualizando trailing stop para {symbol}: {position['current_sl']:.2f} → {new_sl:.2f} (Precio: {current_price})")
+                logging.info("📈 Actualizando trailing stop para %s: %.2f → %.2f (Precio: %s)", symbol, position['current_sl'], new_sl, current_price)
                 
                 # Actualizar en Bybit
                 self.bybit_client.set_trading_stop(symbol, new_sl)
@@ -287,6 +630,7 @@ class StrategyManager:
                 # Actualizar localmente
                 position['current_sl'] = new_sl
                 position['last_sl_update'] = datetime.now(timezone.utc)
+                self._publish_state(symbol)
 
     async def _remove_position_from_pools(self, symbol):
         """
@@ -302,9 +646,42 @@ class StrategyManager:
             del self.active_trailing_pool[symbol]
             removed_from = "trailing activo"
         
+        for order_id in [o for o, order in self.closing_orders.items() if order['symbol'] == symbol]:
+            del self.closing_orders[order_id]
+        
         if removed_from:
-            logging.info(f"❌ {symbol} cerrado y removido del pool de {removed_from}")
-            logging.info(f"📊 Pools actuales - Monitoreo: {len(self.monitoring_pool)}, Trailing: {len(self.active_trailing_pool)}")
+            logging.info("❌ %s cerrado y removido del pool de %s", symbol, removed_from)
+            self._log_pool_counts()
+            self._publish_state(symbol)
+
+    def _log_pool_counts(self):
+        """
+        Registra el tamaño de los pools. Con muchas posiciones este mensaje se repite
+        en cada activación/cierre, por eso va con rate limiting (ver log_config).
+        """
+        logging.info("📊 Pools actuales - Monitoreo: %d, Trailing: %d",
+                     len(self.monitoring_pool), len(self.active_trailing_pool),
+                     extra={'rate_key': 'pool_counts'})
+
+    @staticmethod
+    def _tighter_sl(side, stop_loss, other_sl):
+        """
+        Devuelve el SL más protector de los dos (ignora ``other_sl`` si es 0).
+        """
+        if other_sl <= 0:
+            return stop_loss
+        return max(stop_loss, other_sl) if side == 'Buy' else min(stop_loss, other_sl)
+
+    @staticmethod
+    def _seq(data):
+        """
+        Número de secuencia (``seq``) de un mensaje de posición, ejecución u orden.
+        Devuelve 0 si no viene informado.
+        """
+        try:
+            return max(0, int(data.get('seq') or 0))
+        except (TypeError, ValueError):
+            return 0
 
     def _calculate_pnl_percent(self, entry_price, current_price, side):
         """
@@ -318,11 +695,43 @@ class StrategyManager:
         else:  # SHORT
             return ((entry_price - current_price) / entry_price) * 100
 
-    def _calculate_initial_sl(self, entry_price, side):
+    def _track_volatility(self, symbol):
+        """
+        Registra el símbolo en el motor de volatilidad (si está habilitado).
+        """
+        if self.volatility_engine is None:
+            return
+        try:
+            self.volatility_engine.track(symbol)
+        except Exception as e:
+            logging.error("Error registrando %s en el motor de volatilidad: %s", symbol, e)
+
+    def _trailing_distance_percent(self, symbol, price):
+        """
+        Distancia del trailing stop en porcentaje. Usa la distancia escalada por ATR
+        del motor de volatilidad cuando está disponible y, si no, el
+        TRAILING_INCREMENT_PERCENT global.
+        """
+        if self.volatility_engine is not None:
+            distance = self.volatility_engine.trailing_distance_percent(symbol, price)
+            if distance is not None:
+                return distance
+        return self.trailing_increment_percent
+
+    def _calculate_initial_sl(self, entry_price, side, symbol=None):
         """
         Calcula el Stop Loss inicial cuando se activa el trailing stop.
         El SL inicial se coloca en el punto de entrada (breakeven).
+        Con el motor de volatilidad habilitado, la distancia a la entrada es la
+        distancia de trailing escalada por ATR del símbolo.
         """
+        if symbol is not None and self.volatility_engine is not None:
+            distance = self.volatility_engine.trailing_distance_percent(symbol, entry_price)
+            if distance is not None:
+                if side == 'Buy':
+                    return entry_price * (1 - (distance / 100))
+                return entry_price * (1 + (distance / 100))
+
         if side == 'Buy':  # LONG
             # SL debajo del precio de entrada
             return entry_price * (1 - (self.trailing_activation_percent / 200))  # Dividido por 200 para más conservador
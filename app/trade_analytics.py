@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from collections import OrderedDict, deque
+
+DAY_MS = 86_400_000
+
+# Buckets diarios conservados para las ventanas móviles
+MAX_DAYS = 366
+
+ALL_SYMBOLS = '__all__'
+
+# Ids de operaciones recientes recordados para no contarlas dos veces (p. ej. tras
+# un reinicio, cuando la conciliación REST vuelve a traer operaciones ya registradas)
+MAX_RECENT_TRADE_IDS = 2000
+
+
+class TradeStats:
+    """
+    Agregado de operaciones cerradas que se actualiza en O(1) por operación.
+
+    Además de contadores y sumas guarda, sobre la curva de PnL acumulado del
+    segmento, el total (``pnl``), el máximo prefijo (``peak``), el mínimo prefijo
+    (``trough``) y el máximo drawdown. Con esos cuatro valores dos segmentos
+    consecutivos se combinan en O(1) (``merge``), lo que permite calcular el
+    drawdown de cualquier ventana a partir de buckets diarios.
+    """
+
+    __slots__ = ('trades', 'wins', 'losses', 'gross_profit', 'gross_loss',
+                 'pnl', 'peak', 'trough', 'max_drawdown',
+                 'giveback_sum', 'giveback_count')
+
+    def __init__(self):
+        self.trades = 0
+        self.wins = 0
+        self.losses = 0
+        self.gross_profit = 0.0
+        self.gross_loss = 0.0
+        self.pnl = 0.0
+        self.peak = 0.0
+        self.trough = 0.0
+        self.max_drawdown = 0.0
+        self.giveback_sum = 0.0
+        self.giveback_count = 0
+
+    def add(self, pnl, giveback_percent=None):
+        self.trades += 1
+        if pnl > 0:
+            self.wins += 1
+            self.gross_profit += pnl
+        elif pnl < 0:
+            self.losses += 1
+            self.gross_loss -= pnl
+
+        self.pnl += pnl
+        if self.pnl > self.peak:
+            self.peak = self.pnl
+        if self.pnl < self.trough:
+            self.trough = self.pnl
+        drawdown = self.peak - self.pnl
+        if drawdown > self.max_drawdown:
+            self.max_drawdown = drawdown
+
+        if giveback_percent is not None:
+            self.giveback_sum += giveback_percent
+            self.giveback_count += 1
+
+    def merge(self, other):
+        """Añade ``other`` como segmento posterior a este (in place)."""
+        crossing_drawdown = (self.peak - self.pnl) - other.trough
+        self.max_drawdown = max(self.max_drawdown, other.max_drawdown, crossing_drawdown)
+        self.peak = max(self.peak, self.pnl + other.peak)
+        self.trough = min(self.trough, self.pnl + other.trough)
+        self.pnl += other.pnl
+
+        self.trades += other.trades
+        self.wins += other.wins
+        self.losses += other.losses
+        self.gross_profit += other.gross_profit
+        self.gross_loss += other.gross_loss
+        self.giveback_sum += other.giveback_sum
+        self.giveback_count += other.giveback_count
+        return self
+
+    def summary(self):
+        trades = self.trades
+        return {
+            'trades': trades,
+            'win_rate': self.wins / trades * 100 if trades else 0.0,
+            'total_pnl': self.pnl,
+            'expectancy': self.pnl / trades if trades else 0.0,
+            'profit_factor': self.gross_profit / self.gross_loss if self.gross_loss else None,
+            'max_drawdown': self.max_drawdown,
+            'avg_giveback_percent': self.giveback_sum / self.giveback_count if self.giveback_count else None,
+        }
+
+    def to_list(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values):
+        stats = cls()
+        for name, value in zip(cls.__slots__, values):
+            setattr(stats, name, value)
+        return stats
+
+
+class TradeAnalytics:
+    """
+    Analítica de rendimiento sobre operaciones cerradas, incremental y persistente.
+
+    Mantiene un agregado global, uno por símbolo y buckets diarios (global y por
+    símbolo, dispersos) de los últimos MAX_DAYS días. Cada operación es O(1); una
+    consulta sobre una ventana de N días combina como mucho N buckets, así que un
+    año de operaciones se responde sin volver a pedir get_closed_pnl.
+
+    Persistencia: ANALYTICS_PATH guarda un snapshot de los agregados (JSON
+    compacto) y ``<ANALYTICS_PATH>.log`` las operaciones posteriores, una por
+    línea. ``add_trade`` solo encola la operación; ``run`` la añade al log cada
+    ANALYTICS_FLUSH_SECONDS desde un hilo, y cada ANALYTICS_COMPACT_EVERY
+    operaciones el log se compacta en un snapshot nuevo. Al cargar se aplica el
+    snapshot y se reproduce el log.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('ANALYTICS_PATH', 'state/analytics.json')
+        self.log_path = f"{self.path}.log"
+        self.flush_interval = float(os.getenv('ANALYTICS_FLUSH_SECONDS', '5'))
+        # Si la compactación se interrumpe entre el snapshot y el vaciado del log,
+        # las operaciones se reproducen dos veces; los ids recientes (que cubren un
+        # log completo) evitan contarlas de nuevo
+        self.compact_every = min(int(os.getenv('ANALYTICS_COMPACT_EVERY', '1000')), MAX_RECENT_TRADE_IDS)
+
+        self.overall = TradeStats()
+        self.per_symbol = {}
+        self.daily = {}
+        self.recent_trade_ids = OrderedDict()
+
+        # Operaciones pendientes de escribir en el log (deque: el hilo de escritura
+        # consume mientras el event loop añade)
+        self._pending = deque()
+        self._logged = 0
+        self._write_lock = threading.Lock()
+        self.load()
+
+    def add_trade(self, symbol, closed_pnl, close_time_ms, giveback_percent=None, trade_id=None, persist=True):
+        """
+        Registra una operación cerrada. Devuelve False si ``trade_id`` ya se había
+        registrado. Con ``persist`` la operación se encola para el log (ver flush).
+        """
+        if trade_id is not None:
+            if trade_id in self.recent_trade_ids:
+                return False
+            self.recent_trade_ids[trade_id] = True
+            if len(self.recent_trade_ids) > MAX_RECENT_TRADE_IDS:
+                self.recent_trade_ids.popitem(last=False)
+
+        self.overall.add(closed_pnl, giveback_percent)
+
+        symbol_stats = self.per_symbol.get(symbol)
+        if symbol_stats is None:
+            symbol_stats = self.per_symbol[symbol] = TradeStats()
+        symbol_stats.add(closed_pnl, giveback_percent)
+
+        day = close_time_ms // DAY_MS
+        buckets = self.daily.get(day)
+        if buckets is None:
+            buckets = self.daily[day] = {ALL_SYMBOLS: TradeStats()}
+            self._prune(day)
+        buckets[ALL_SYMBOLS].add(closed_pnl, giveback_percent)
+        day_symbol = buckets.get(symbol)
+        if day_symbol is None:
+            day_symbol = buckets[symbol] = TradeStats()
+        day_symbol.add(closed_pnl, giveback_percent)
+
+        if persist:
+            self._pending.append([symbol, closed_pnl, close_time_ms, giveback_percent, trade_id])
+        return True
+
+    def _prune(self, newest_day):
+        if len(self.daily) <= MAX_DAYS:
+            return
+        cutoff = newest_day - MAX_DAYS
+        for day in [d for d in self.daily if d <= cutoff]:
+            del self.daily[day]
+
+    def report(self, days=None, symbol=None, now_ms=None):
+        """
+        Estadísticas de las operaciones cerradas.
+
+        Args:
+            days: Ventana móvil en días (None para todo el histórico)
+            symbol: Símbolo específico (opcional)
+            now_ms: Fin de la ventana en milisegundos (default: ahora)
+        """
+        if days is None:
+            if symbol is None:
+                return self.overall.summary()
+            return self.per_symbol.get(symbol, TradeStats()).summary()
+
+        today = (now_ms if now_ms is not None else int(time.time() * 1000)) // DAY_MS
+        key = symbol or ALL_SYMBOLS
+        stats = TradeStats()
+        for day in range(today - days + 1, today + 1):
+            buckets = self.daily.get(day)
+            if buckets is not None and key in buckets:
+                stats.merge(buckets[key])
+        return stats.summary()
+
+    def report_by_symbol(self, days=None, now_ms=None):
+        """Estadísticas por símbolo, ordenadas por PnL total."""
+        if days is None:
+            symbols = self.per_symbol.keys()
+        else:
+            today = (now_ms if now_ms is not None else int(time.time() * 1000)) // DAY_MS
+            symbols = {s for day in range(today - days + 1, today + 1)
+                       for s in self.daily.get(day, ()) if s != ALL_SYMBOLS}
+        reports = {s: self.report(days, s, now_ms) for s in symbols}
+        return dict(sorted(reports.items(), key=lambda item: item[1]['total_pnl'], reverse=True))
+
+    async def run(self):
+        """Escribe periódicamente las operaciones pendientes, fuera del event loop."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                try:
+                    await asyncio.to_thread(self.flush)
+                except Exception as e:
+                    logging.error("Error guardando la analítica de operaciones: %s", e)
+        finally:
+            self.flush()
+
+    def flush(self):
+        """
+        Añade las operaciones pendientes al log y lo compacta cuando acumula
+        ANALYTICS_COMPACT_EVERY operaciones. Solo toca archivos, nunca los
+        agregados en memoria, así que se puede ejecutar en otro hilo.
+        """
+        with self._write_lock:
+            lines = []
+            while self._pending:
+                lines.append(json.dumps(self._pending.popleft(), separators=(',', ':')) + '\n')
+            if not lines:
+                return
+            self._logged += len(lines)
+
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.log_path, 'a+b') as log:
+                # Si un flush anterior quedó interrumpido, su línea incompleta se
+                # cierra para que no se mezcle con la siguiente
+                if log.tell() > 0:
+                    log.seek(-1, os.SEEK_END)
+                    if log.read(1) != b'\n':
+                        lines.insert(0, '\n')
+                log.write(''.join(lines).encode())
+
+            if self._logged >= self.compact_every:
+                self._compact()
+
+    def _compact(self):
+        # Estado independiente reconstruido desde disco (snapshot + log), para no
+        # leer los agregados que el event loop está modificando
+        snapshot = TradeAnalytics(self.path)
+        snapshot.save()
+        open(self.log_path, 'w').close()
+        self._logged = 0
+
+    def save(self):
+        """
+        Guarda los agregados de forma atómica como snapshot. Es JSON lines (una
+        cabecera y una línea por día) para que cada línea se serialice por
+        separado y un hilo que compacta no retenga el GIL durante todo el archivo.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as tmp:
+            tmp.write(json.dumps({
+                'overall': self.overall.to_list(),
+                'per_symbol': {s: stats.to_list() for s, stats in self.per_symbol.items()},
+                'recent_trade_ids': list(self.recent_trade_ids),
+            }, separators=(',', ':')) + '\n')
+            for day, buckets in self.daily.items():
+                tmp.write(json.dumps({
+                    'day': day,
+                    'buckets': {s: stats.to_list() for s, stats in buckets.items()}
+                }, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Carga el snapshot guardado (si existe) y reproduce el log posterior."""
+        self._load_snapshot()
+        self._replay_log()
+
+    def _load_snapshot(self):
+        try:
+            with open(self.path) as f:
+                header = json.loads(f.readline())
+                daily = {}
+                for line in f:
+                    record = json.loads(line)
+                    daily[int(record['day'])] = {s: TradeStats.from_list(v) for s, v in record['buckets'].items()}
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            logging.error("Error cargando la analítica de operaciones (%s): %s", self.path, e)
+            return
+
+        self.overall = TradeStats.from_list(header.get('overall', []))
+        self.per_symbol = {s: TradeStats.from_list(v) for s, v in header.get('per_symbol', {}).items()}
+        self.daily = daily
+        self.recent_trade_ids = OrderedDict((trade_id, True) for trade_id in header.get('recent_trade_ids', []))
+
+    def _replay_log(self):
+        try:
+            with open(self.log_path, 'rb') as log:
+                content = log.read()
+        except FileNotFoundError:
+            return
+
+        # Una última línea sin '\n' está a medio escribir (flush en curso o
+        # interrumpido) y no se aplica
+        complete = content[:content.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            try:
+                self.add_trade(*json.loads(line), persist=False)
+            except (ValueError, TypeError) as e:
+                logging.warning("Línea inválida en el log de analítica: %s", e)
+                continue
+            self._logged += 1
+
+
+def format_report(title, report):
+    profit_factor = report['profit_factor']
+    giveback = report['avg_giveback_percent']
+    return (f"{title}: {report['trades']} operaciones, Win rate: {report['win_rate']:.1f}%, "
+            f"PnL: {report['total_pnl']:.2f}, Expectativa: {report['expectancy']:.2f}, "
+            f"Profit factor: {'N/A' if profit_factor is None else f'{profit_factor:.2f}'}, "
+            f"Max drawdown: {report['max_drawdown']:.2f}, "
+            f"Give-back medio: {'N/A' if giveback is None else f'{giveback:.2f}%'}")
+
+
+def main(argv=None):
+    """CLI: consulta los agregados guardados sin llamar a la API de Bybit."""
+    parser = argparse.ArgumentParser(description="Analítica de operaciones cerradas del bot de trailing stop")
+    parser.add_argument('--path', default=None, help="Archivo de agregados (default: ANALYTICS_PATH o state/analytics.json)")
+    parser.add_argument('--days', type=int, default=None, help="Ventana móvil en días (default: todo el histórico)")
+    parser.add_argument('--symbol', default=None, help="Filtrar por símbolo")
+    parser.add_argument('--by-symbol', action='store_true', help="Desglose por símbolo")
+    args = parser.parse_args(argv)
+
+    analytics = TradeAnalytics(args.path)
+    window = f"últimos {args.days} días" if args.days else "histórico"
+
+    if args.by_symbol:
+        for symbol, report in analytics.report_by_symbol(args.days).items():
+            print(format_report(f"{symbol} ({window})", report))
+    else:
+        print(format_report(f"{args.symbol or 'Total'} ({window})", analytics.report(args.days, args.symbol)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
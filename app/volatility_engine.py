@@ -0,0 +1,246 @@
+import os
+import math
+import asyncio
+import logging
+from array import array
+
+
+class SymbolVolatility:
+    """
+    Estado de volatilidad de un símbolo sobre velas cerradas.
+
+    Mantiene el True Range y el retorno logarítmico de las últimas ``period`` velas
+    en dos ring buffers de tamaño fijo (``array('d')`` reservado al crear el estado)
+    junto con sus sumas acumuladas, de modo que cada vela nueva es O(1) y no crea
+    contenedores nuevos. Las sumas se recalculan desde los buffers cada vez que el
+    índice da la vuelta para evitar la deriva de punto flotante (O(1) amortizado).
+    """
+
+    __slots__ = ('period', 'tr_buffer', 'ret_buffer', 'index', 'count',
+                 'tr_sum', 'ret_sum', 'ret_sq_sum', 'prev_close', 'last_start')
+
+    def __init__(self, period):
+        self.period = period
+        self.tr_buffer = array('d', bytes(8 * period))
+        self.ret_buffer = array('d', bytes(8 * period))
+        self.index = 0
+        self.count = 0
+        self.tr_sum = 0.0
+        self.ret_sum = 0.0
+        self.ret_sq_sum = 0.0
+        self.prev_close = None
+        self.last_start = 0
+
+    def update(self, start, high, low, close):
+        """
+        Agrega una vela cerrada. Las velas repetidas o anteriores a la última
+        (p. ej. solapamiento entre el seed REST y el stream) se ignoran.
+        """
+        if start <= self.last_start:
+            return
+        self.last_start = start
+
+        prev_close = self.prev_close
+        self.prev_close = close
+        if prev_close is None or prev_close <= 0 or close <= 0:
+            return
+
+        true_range = max(high - low, abs(high - prev_close), abs(low - prev_close))
+        log_return = math.log(close / prev_close)
+
+        i = self.index
+        old_tr = self.tr_buffer[i]
+        old_ret = self.ret_buffer[i]
+        self.tr_buffer[i] = true_range
+        self.ret_buffer[i] = log_return
+
+        if self.count < self.period:
+            self.count += 1
+            self.tr_sum += true_range
+            self.ret_sum += log_return
+            self.ret_sq_sum += log_return * log_return
+        else:
+            self.tr_sum += true_range - old_tr
+            self.ret_sum += log_return - old_ret
+            self.ret_sq_sum += log_return * log_return - old_ret * old_ret
+
+        i += 1
+        if i == self.period:
+            i = 0
+            self._resync()
+        self.index = i
+
+    def _resync(self):
+        tr_sum = 0.0
+        ret_sum = 0.0
+        ret_sq_sum = 0.0
+        for j in range(self.count):
+            tr_sum += self.tr_buffer[j]
+            r = self.ret_buffer[j]
+            ret_sum += r
+            ret_sq_sum += r * r
+        self.tr_sum = tr_sum
+        self.ret_sum = ret_sum
+        self.ret_sq_sum = ret_sq_sum
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+    @property
+    def atr(self):
+        """ATR simple (media del True Range) sobre la ventana, o None si no está lleno."""
+        if self.count < self.period:
+            return None
+        return self.tr_sum / self.count
+
+    @property
+    def volatility(self):
+        """Desviación estándar de los retornos logarítmicos por vela, o None si no está lleno."""
+        if self.count < self.period:
+            return None
+        mean = self.ret_sum / self.count
+        variance = self.ret_sq_sum / self.count - mean * mean
+        return math.sqrt(variance) if variance > 0 else 0.0
+
+
+class VolatilityEngine:
+    """
+    Motor de indicadores de volatilidad en streaming para los símbolos con posición.
+
+    Se suscribe al stream público de klines de Bybit por cada símbolo que se le
+    pide seguir (``track``), siembra la ventana con velas históricas vía REST (en
+    un hilo, fuera del event loop) y a partir de ahí actualiza ATR y volatilidad
+    en O(1) por vela cerrada. El StrategyManager lo consulta con
+    ``trailing_distance_percent`` para escalar la distancia del trailing stop a la
+    volatilidad de cada símbolo.
+    """
+
+    def __init__(self, bybit_client):
+        self.bybit_client = bybit_client
+
+        self.period = int(os.getenv('ATR_PERIOD', '14'))
+        self.interval = os.getenv('ATR_INTERVAL', '5')
+        self.multiplier = float(os.getenv('ATR_TRAILING_MULTIPLIER', '1.5'))
+        self.min_distance_percent = float(os.getenv('ATR_MIN_DISTANCE_PERCENT', '0.20'))
+        self.max_distance_percent = float(os.getenv('ATR_MAX_DISTANCE_PERCENT', '5.0'))
+
+        self.symbols = {}
+
+        # Símbolos con el seed en curso -> velas del stream recibidas mientras tanto
+        self.seeding = {}
+        self.seed_tasks = set()
+
+        logging.info("VolatilityEngine iniciado - ATR(%d) en velas de %s min, Multiplicador: %s, Rango: %s%%-%s%%",
+                     self.period, self.interval, self.multiplier,
+                     self.min_distance_percent, self.max_distance_percent)
+
+    def track(self, symbol):
+        """
+        Empieza a seguir un símbolo. Es idempotente; el estado se conserva si la
+        posición se cierra y se vuelve a abrir.
+
+        El seed REST y la suscripción a klines son bloqueantes, así que se hacen
+        en un hilo (``asyncio.to_thread``) sin frenar el event loop. Hasta que el
+        símbolo tiene la ventana completa ``trailing_distance_percent`` devuelve
+        None y el StrategyManager usa la distancia fija.
+        """
+        if symbol in self.symbols or symbol in self.seeding:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None:
+            state = SymbolVolatility(self.period)
+            self._seed(symbol, state)
+            self.symbols[symbol] = state
+            self._subscribe(symbol)
+            return
+
+        # Velas recibidas por el stream mientras se siembra la ventana
+        self.seeding[symbol] = []
+        task = loop.create_task(self._seed_in_background(symbol))
+        self.seed_tasks.add(task)
+        task.add_done_callback(self.seed_tasks.discard)
+
+    async def _seed_in_background(self, symbol):
+        state = SymbolVolatility(self.period)
+        try:
+            await asyncio.to_thread(self._subscribe, symbol)
+            await asyncio.to_thread(self._seed, symbol, state)
+        except Exception as e:
+            logging.error("Error sembrando la volatilidad de %s: %s", symbol, e)
+        finally:
+            # Las velas del stream posteriores al seed se aplican antes de publicar
+            # el estado (las repetidas se ignoran en update)
+            for candle in self.seeding.pop(symbol, ()):
+                state.update(*candle)
+            self.symbols[symbol] = state
+
+    def _subscribe(self, symbol):
+        try:
+            self.bybit_client.subscribe_kline(symbol, self.interval, self.on_kline)
+        except Exception as e:
+            logging.error("Error suscribiendo klines de %s: %s", symbol, e)
+
+    def _seed(self, symbol, state):
+        response = self.bybit_client.get_kline(symbol, self.interval, limit=self.period + 2)
+        if not response or 'result' not in response:
+            logging.warning("No se pudieron cargar velas históricas de %s", symbol)
+            return
+
+        candles = response['result'].get('list', [])
+        # Bybit devuelve las velas de la más reciente a la más antigua; la primera
+        # es la vela en curso y todavía no está cerrada.
+        for candle in reversed(candles[1:]):
+            state.update(int(candle[0]), float(candle[2]), float(candle[3]), float(candle[4]))
+
+        logging.info("Volatilidad de %s sembrada con %d velas - ATR: %s", symbol, state.count, state.atr)
+
+    def on_kline(self, message):
+        """Procesa un mensaje del stream de klines (solo velas cerradas)."""
+        topic = message.get('topic', '')
+        symbol = topic.rsplit('.', 1)[-1]
+        state = self.symbols.get(symbol)
+        pending = self.seeding.get(symbol) if state is None else None
+        if state is None and pending is None:
+            return
+
+        for candle in message.get('data', ()):
+            if not candle.get('confirm'):
+                continue
+            values = (int(candle['start']), float(candle['high']), float(candle['low']), float(candle['close']))
+            if state is not None:
+                state.update(*values)
+            else:
+                pending.append(values)
+
+    def atr(self, symbol):
+        state = self.symbols.get(symbol)
+        return state.atr if state is not None else None
+
+    def volatility(self, symbol):
+        state = self.symbols.get(symbol)
+        return state.volatility if state is not None else None
+
+    def trailing_distance_percent(self, symbol, price):
+        """
+        Distancia del trailing stop en porcentaje del precio: ``multiplier * ATR``,
+        acotada a [ATR_MIN_DISTANCE_PERCENT, ATR_MAX_DISTANCE_PERCENT]. Devuelve None
+        si el símbolo todavía no tiene ventana completa.
+        """
+        state = self.symbols.get(symbol)
+        if state is None or price <= 0:
+            return None
+        atr = state.atr
+        if atr is None:
+            return None
+        distance = self.multiplier * atr / price * 100
+        if distance < self.min_distance_percent:
+            return self.min_distance_percent
+        if distance > self.max_distance_percent:
+            return self.max_distance_percent
+        return distance
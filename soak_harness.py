@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Soak test del bot de trailing stop con reloj acelerado.
+
+Ejecuta el grafo de tareas completo de app/main.py (BybitClient, StrategyManager,
+DataLogger...) contra un exchange simulado en memoria y genera días de actividad
+sintética (aperturas, movimientos de precio, stops y cierres) sobre cientos de
+símbolos. El reloj del event loop salta los periodos ociosos, así que las esperas
+(sleep, timeouts) no consumen tiempo real, mientras que el tiempo de CPU y las
+colas sí se reflejan en la latencia medida.
+
+A lo largo de la simulación registra RSS, profundidad de las colas, lag del event
+loop y latencia de SL (desde el push de posición hasta la llamada a
+set_trading_stop), y falla si la memoria o la latencia derivan más allá de los
+umbrales configurados.
+
+Uso:
+    python soak_harness.py --days 2 --symbols 300
+"""
+
+import os
+import sys
+import math
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import itertools
+import selectors
+import tempfile
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+# Muestras mínimas por tercio para evaluar la deriva de latencia
+MIN_DRIFT_SAMPLES = 3
+
+
+class _SkippingSelector(selectors.DefaultSelector):
+    """
+    Selector que no bloquea: si no hay I/O lista, avisa al loop para que adelante
+    su reloj hasta el siguiente timer en lugar de esperar en tiempo real.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+
+    def select(self, timeout=None):
+        if timeout is None or timeout <= 0:
+            return super().select(timeout)
+        events = super().select(0)
+        if not events:
+            self.loop.skip(timeout)
+        return events
+
+
+class AcceleratedEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop cuyo reloj es el tiempo real más el tiempo ocioso saltado.
+    """
+
+    def __init__(self):
+        selector = _SkippingSelector()
+        super().__init__(selector=selector)
+        selector.loop = self
+        self._skipped = 0.0
+
+    def skip(self, seconds):
+        self._skipped += seconds
+
+    def time(self):
+        return time.monotonic() + self._skipped
+
+
+def current_rss_mb():
+    """RSS actual del proceso en MiB (pico de RSS si /proc no está disponible)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(math.ceil(pct / 100 * len(ordered))) - 1)
+    return ordered[max(0, index)]
+
+
+def build_simulated_client(args):
+    # Importación diferida: bybit_client requiere pybit instalado
+    from bybit_client import BybitClient
+
+    class SimulatedBybitClient(BybitClient):
+        """
+        Exchange simulado con la interfaz de BybitClient. No abre conexiones: los
+        eventos de position/execution/order se entregan a las colas con el mismo
+        _dispatch_event que usa el cliente real.
+        """
+
+        def __init__(self):
+            # Sin credenciales ni sesión HTTP
+            self.testnet = True
+            self._init_state()
+
+            self.random = random.Random(args.seed)
+            self.symbols = [f"SIM{i:04d}USDT" for i in range(args.symbols)]
+            self.push_interval = args.push_interval
+            self.step_sigma = args.hourly_volatility / 100 * math.sqrt(args.push_interval / 3600)
+            self.order_ids = itertools.count(1)
+            self.seqs = itertools.count(1)
+
+            self.positions = {}
+            self.reopen_at = {}
+            self.last_push = {}
+            self.sl_latencies = []
+            self.counters = {'position_events': 0, 'opens': 0, 'closes': 0, 'sl_calls': 0}
+
+            self.epoch_ms = int(time.time() * 1000)
+            self.clock_origin = None
+
+            for symbol in self.symbols:
+                self._open(symbol, 0.0)
+
+        def _now(self):
+            return self.loop.time() - self.clock_origin if self.loop is not None else 0.0
+
+        def _now_ms(self):
+            return self.epoch_ms + int(self._now() * 1000)
+
+        def _open(self, symbol, now):
+            entry = self.random.uniform(0.5, 50000)
+            self.positions[symbol] = {
+                'side': self.random.choice(('Buy', 'Sell')),
+                'size': round(self.random.uniform(0.01, 10), 3),
+                'entry': entry,
+                'price': entry,
+                'sl': 0.0,
+                'trail': 0.0,
+                'active_price': 0.0,
+                'close_at': now + self.random.expovariate(1 / args.lifetime_mean)
+            }
+            self.counters['opens'] += 1
+
+        def _payload(self, symbol, pos):
+            direction = 1 if pos['side'] == 'Buy' else -1
+            return {
+                'symbol': symbol,
+                'side': pos['side'],
+                'size': str(pos['size']),
+                'avgPrice': str(pos['entry']),
+                'markPrice': str(pos['price']),
+                'unrealisedPnl': str((pos['price'] - pos['entry']) * pos['size'] * direction),
+                'stopLoss': str(pos['sl']),
+                'trailingStop': str(pos['trail']),
+                'seq': next(self.seqs)
+            }
+
+        def _push(self, topic, data):
+            self._dispatch_event({'topic': topic, 'data': {'topic': topic, 'data': data}})
+
+        def _push_position(self, symbol, pos):
+            self.last_push[symbol] = self.loop.time()
+            self.counters['position_events'] += 1
+            self._push('position', [self._payload(symbol, pos)])
+
+        def _close(self, symbol, pos, price, stop_order_type):
+            direction = 1 if pos['side'] == 'Buy' else -1
+            closing_side = 'Sell' if pos['side'] == 'Buy' else 'Buy'
+            order_id = f"sim-{next(self.order_ids)}"
+            now_ms = self._now_ms()
+
+            self._push('execution', [{
+                'symbol': symbol, 'execType': 'Trade', 'orderId': order_id,
+                'side': closing_side, 'execPrice': str(price), 'execQty': str(pos['size']),
+                'closedSize': str(pos['size']), 'leavesQty': '0', 'execFee': '0',
+                'execPnl': str((price - pos['entry']) * pos['size'] * direction),
+                'stopOrderType': stop_order_type, 'orderType': 'Market', 'execTime': str(now_ms),
+                'seq': next(self.seqs)
+            }])
+            self._push('order', [{
+                'symbol': symbol, 'orderId': order_id, 'orderStatus': 'Filled',
+                'stopOrderType': stop_order_type, 'side': closing_side
+            }])
+            self._push('position', [{'symbol': symbol, 'side': '', 'size': '0', 'seq': next(self.seqs)}])
+
+            del self.positions[symbol]
+            self.reopen_at[symbol] = self._now() + self.random.expovariate(1 / args.reopen_mean)
+            self.counters['closes'] += 1
+
+        async def _symbol_loop(self, symbol):
+            while True:
+                await asyncio.sleep(self.push_interval * self.random.uniform(0.5, 1.5))
+                now = self._now()
+                pos = self.positions.get(symbol)
+
+                if pos is None:
+                    if now >= self.reopen_at.get(symbol, 0.0):
+                        self._open(symbol, now)
+                        self._push_position(symbol, self.positions[symbol])
+                    continue
+
+                price = pos['price'] * math.exp(self.random.gauss(0, self.step_sigma))
+                pos['price'] = price
+
+                # Trailing stop nativo (TRAILING_MODE=exchange)
+                if pos['trail'] > 0:
+                    if pos['side'] == 'Buy' and price >= pos['active_price']:
+                        pos['sl'] = max(pos['sl'], price - pos['trail'])
+                    elif pos['side'] == 'Sell' and price <= pos['active_price']:
+                        pos['sl'] = min(pos['sl'], price + pos['trail']) if pos['sl'] else price + pos['trail']
+
+                stop_hit = pos['sl'] > 0 and ((pos['side'] == 'Buy' and price <= pos['sl']) or
+                                              (pos['side'] == 'Sell' and price >= pos['sl']))
+                if stop_hit:
+                    self._close(symbol, pos, pos['sl'], 'TrailingStop' if pos['trail'] > 0 else 'StopLoss')
+                elif now >= pos['close_at']:
+                    self._close(symbol, pos, price, '')
+                else:
+                    self._push_position(symbol, pos)
+
+        def connect_and_listen_websocket(self, event_queue):
+            self.event_queue = event_queue
+
+            async def _market():
+                self.loop = asyncio.get_running_loop()
+                if self.clock_origin is None:
+                    self.clock_origin = self.loop.time()
+                await asyncio.gather(*(self._symbol_loop(symbol) for symbol in self.symbols))
+
+            return _market()
+
+        def set_trading_stop(self, symbol, stop_loss, side=None, trailing_stop=None, active_price=None):
+            self.counters['sl_calls'] += 1
+            pos = self.positions.get(symbol)
+            if pos is None:
+                return {'retCode': 10001, 'retMsg': 'position not exists'}
+
+            if symbol in self.last_push:
+                self.sl_latencies.append(self.loop.time() - self.last_push[symbol])
+
+            if stop_loss is not None:
+                pos['sl'] = float(stop_loss)
+            if trailing_stop is not None:
+                pos['trail'] = float(trailing_stop)
+                pos['active_price'] = float(active_price or 0)
+            return {'retCode': 0, 'result': {}}
+
+        def get_open_positions(self):
+            return {'retCode': 0, 'result': {'list': [self._payload(s, p) for s, p in self.positions.items()]}}
+
+        def get_closed_pnl(self, symbol=None, start_time=None, limit=50):
+            return {'retCode': 0, 'result': {'list': []}}
+
+        def get_wallet_balance(self):
+            return {'retCode': 0, 'result': {'list': []}}
+
+        def get_tick_size(self, symbol):
+            return Decimal('0.0001')
+
+        def get_kline(self, symbol, interval, limit=200):
+            return {'retCode': 0, 'result': {'list': []}}
+
+        def subscribe_kline(self, symbol, interval, callback):
+            pass
+
+    return SimulatedBybitClient()
+
+
+async def sample_loop_lag(lag_monitor, interval):
+    """Muestrea el lag del event loop con el histograma de LoopLagMonitor."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag_monitor.record(max(0.0, loop.time() - expected))
+
+
+async def run_soak(args):
+    import main as bot_main
+    from diagnostics import LoopLagMonitor
+
+    sim = build_simulated_client(args)
+    lag_monitor = LoopLagMonitor()
+    loop = asyncio.get_running_loop()
+
+    bot_task = asyncio.ensure_future(bot_main.main(bybit_client=sim))
+    lag_task = asyncio.ensure_future(sample_loop_lag(lag_monitor, 1.0))
+
+    samples = []
+    duration = args.days * 86400
+    start_real = time.perf_counter()
+    start = loop.time()
+    last_events = 0
+
+    print(f"{'t (h)':>7} {'RSS MiB':>8} {'cola':>6} {'cola DL':>7} {'lag avg':>8} {'lag max':>8} "
+          f"{'SL p50':>8} {'SL p99':>8} {'eventos':>9} {'abiertas':>8} {'cierres':>8}")
+
+    try:
+        while loop.time() - start < duration:
+            await asyncio.sleep(args.sample_hours * 3600)
+            if bot_task.done():
+                bot_task.result()
+                raise RuntimeError("El bot terminó antes de completar el soak test")
+
+            latencies = sim.sl_latencies
+            sim.sl_latencies = []
+            lag = lag_monitor.snapshot()
+            sample = {
+                'hours': (loop.time() - start) / 3600,
+                'rss_mb': current_rss_mb(),
+                'queue': sim.event_queue.qsize() if sim.event_queue else 0,
+                'trade_queue': sum(q.qsize() for q, _ in sim.event_queues),
+                'lag_avg_ms': lag['avg_ms'],
+                'lag_max_ms': lag['max_ms'],
+                'sl_p50_ms': percentile(latencies, 50) * 1000,
+                'sl_p99_ms': percentile(latencies, 99) * 1000,
+                'events': sim.counters['position_events'] - last_events,
+                'open': len(sim.positions),
+                'closes': sim.counters['closes'],
+            }
+            last_events = sim.counters['position_events']
+            samples.append(sample)
+
+            print(f"{sample['hours']:>7.1f} {sample['rss_mb']:>8.1f} {sample['queue']:>6} {sample['trade_queue']:>7} "
+                  f"{sample['lag_avg_ms']:>7.1f}ms {sample['lag_max_ms']:>6.0f}ms "
+                  f"{sample['sl_p50_ms']:>6.0f}ms {sample['sl_p99_ms']:>6.0f}ms "
+                  f"{sample['events']:>9} {sample['open']:>8} {sample['closes']:>8}", flush=True)
+    finally:
+        lag_task.cancel()
+        bot_task.cancel()
+        await asyncio.gather(bot_task, lag_task, return_exceptions=True)
+
+    elapsed = time.perf_counter() - start_real
+    print(f"\nSimulados {args.days} días en {elapsed:.0f}s reales "
+          f"({duration / elapsed:.0f}x) - Eventos de posición: {sim.counters['position_events']}, "
+          f"Aperturas: {sim.counters['opens']}, Cierres: {sim.counters['closes']}, "
+          f"Llamadas SL: {sim.counters['sl_calls']}")
+
+    return evaluate(samples, args)
+
+
+def evaluate(samples, args):
+    """
+    Compara el primer y el último tercio de la simulación (descartando la primera
+    muestra como calentamiento) y devuelve la lista de fallos.
+
+    La deriva de latencia y lag se mide con la mediana de cada tercio: un pico
+    aislado del sistema operativo no cuenta, una subida sostenida sí. Con menos
+    de MIN_DRIFT_SAMPLES muestras por tercio no se evalúa.
+    """
+    failures = []
+    steady = samples[1:]
+    if len(steady) < 3:
+        print("⚠️  Muy pocas muestras para evaluar la deriva (aumenta --days o reduce --sample-hours)")
+        return failures
+
+    third = max(1, len(steady) // 3)
+    first, last = steady[:third], steady[-third:]
+
+    def mean(values):
+        return sum(values) / len(values)
+
+    rss_first = mean([s['rss_mb'] for s in first])
+    rss_last = mean([s['rss_mb'] for s in last])
+    rss_growth = (rss_last - rss_first) / rss_first * 100
+    print(f"RSS: {rss_first:.1f} → {rss_last:.1f} MiB ({rss_growth:+.1f}%, máx {args.max_rss_growth:.0f}%)")
+    if rss_growth > args.max_rss_growth:
+        failures.append(f"Crecimiento de memoria {rss_growth:.1f}% > {args.max_rss_growth:.0f}%")
+
+    if third < MIN_DRIFT_SAMPLES:
+        print(f"⚠️  Menos de {MIN_DRIFT_SAMPLES} muestras por tercio: no se evalúa la deriva de latencia "
+              f"(aumenta --days o reduce --sample-hours)")
+    for key, label, floor in (('sl_p99_ms', 'Latencia SL p99', args.latency_floor_ms),
+                              ('lag_max_ms', 'Lag máx. del loop', args.loop_lag_floor_ms)):
+        if third < MIN_DRIFT_SAMPLES:
+            break
+        before = statistics.median([s[key] for s in first])
+        after = statistics.median([s[key] for s in last])
+        ratio = after / before if before > 0 else (float('inf') if after > 0 else 1.0)
+        print(f"{label}: {before:.1f} → {after:.1f} ms (x{ratio:.2f}, máx x{args.max_latency_drift:.1f}, "
+              f"umbral {floor:.0f} ms)")
+        if after > floor and ratio > args.max_latency_drift:
+            failures.append(f"{label} derivó x{ratio:.2f} ({before:.1f} → {after:.1f} ms)")
+
+    worst_lag = max(s['lag_max_ms'] for s in steady)
+    print(f"Peor lag del loop: {worst_lag:.1f} ms (máx {args.max_loop_lag_ms:.0f} ms)")
+    if worst_lag > args.max_loop_lag_ms:
+        failures.append(f"Lag del loop de {worst_lag:.1f} ms > {args.max_loop_lag_ms:.0f} ms")
+
+    final_queue = samples[-1]['queue'] + samples[-1]['trade_queue']
+    print(f"Profundidad final de colas: {final_queue} (máx {args.max_queue_depth})")
+    if final_queue > args.max_queue_depth:
+        failures.append(f"Colas con {final_queue} eventos pendientes > {args.max_queue_depth}")
+
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Soak test del bot con exchange simulado y reloj acelerado")
+    parser.add_argument('--days', type=float, default=2, help="Días simulados (default 2)")
+    parser.add_argument('--symbols', type=int, default=300, help="Símbolos simulados (default 300)")
+    parser.add_argument('--push-interval', type=float, default=10, help="Segundos simulados entre pushes de posición por símbolo (default 10, ~21 eventos/s medidos con 300 símbolos)")
+    parser.add_argument('--hourly-volatility', type=float, default=1.0, help="Volatilidad horaria del precio en %% (default 1.0)")
+    parser.add_argument('--lifetime-mean', type=float, default=6 * 3600, help="Duración media de una posición sin stop, en segundos (default 6h)")
+    parser.add_argument('--reopen-mean', type=float, default=1800, help="Espera media antes de reabrir un símbolo, en segundos (default 30min)")
+    parser.add_argument('--sample-hours', type=float, default=2, help="Horas simuladas entre muestras (default 2)")
+    parser.add_argument('--seed', type=int, default=1, help="Semilla del generador aleatorio")
+    parser.add_argument('--max-rss-growth', type=float, default=25, help="Crecimiento máximo de RSS en %% (default 25)")
+    parser.add_argument('--max-latency-drift', type=float, default=2.0, help="Deriva máxima de latencia/lag, como ratio (default 2.0)")
+    parser.add_argument('--latency-floor-ms', type=float, default=250, help="Por debajo de esta latencia de SL no se evalúa la deriva (default 250ms)")
+    parser.add_argument('--loop-lag-floor-ms', type=float, default=2, help="Por debajo de este lag del loop no se evalúa la deriva (default 2ms)")
+    parser.add_argument('--max-loop-lag-ms', type=float, default=100, help="Lag máximo del loop en cualquier muestra (default 100ms)")
+    parser.add_argument('--max-queue-depth', type=int, default=1000, help="Eventos pendientes máximos al final (default 1000)")
+    parser.add_argument('--log-level', default='WARNING', help="LOG_LEVEL del bot durante el soak (default WARNING)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    state_dir = tempfile.mkdtemp(prefix='soak-')
+    os.environ['LOG_LEVEL'] = args.log_level
+    os.environ['LOOP_LAG_MONITOR'] = 'false'
+    os.environ['FAILOVER_ENABLED'] = 'false'
+    os.environ['PROFILE_DIR'] = os.path.join(state_dir, 'profiles')
+    os.environ['ANALYTICS_PATH'] = os.path.join(state_dir, 'analytics.json')
+
+    print("=" * 60)
+    print(f"SOAK TEST - {args.days} días, {args.symbols} símbolos, push cada {args.push_interval}s")
+    print(f"Estado temporal en {state_dir}")
+    print("=" * 60)
+
+    loop = AcceleratedEventLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        failures = loop.run_until_complete(run_soak(args))
+    finally:
+        loop.close()
+
+    print("\n" + "=" * 60)
+    if failures:
+        print("❌ SOAK TEST FALLIDO")
+        for failure in failures:
+            print(f"   • {failure}")
+        print("=" * 60)
+        return 1
+
+    print("✅ SOAK TEST SUPERADO")
+    print("=" * 60)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())